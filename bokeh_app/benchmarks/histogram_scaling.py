@@ -0,0 +1,94 @@
+# Histogram update latency against carrier count and row count
+#
+# Compares the original per-carrier loop (mask, np.histogram, DataFrame,
+# string formatting, append, sort) with the single pass engine in
+# scripts/binning.py, with and without the prefix sum DelayCube, and
+# checks that they all give the same proportions.
+#
+# Run from the bokeh_app directory:
+#     python -m benchmarks.histogram_scaling [--rows 100000 1000000] [--json out.json]
+
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.binning import carrier_histograms, DelayCube
+from scripts.index import FlightIndex
+from benchmarks.synthetic import make_flights
+
+# The histogram dataset as it was computed before the engine
+def loop_histograms(flights, carrier_list, colors, range_start, range_end, bin_width):
+	frames = []
+	for i, carrier_name in enumerate(carrier_list):
+		subset = flights[flights['name'] == carrier_name]
+		arr_hist, edges = np.histogram(subset['arr_delay'],
+									   bins = int((range_end - range_start) / bin_width),
+									   range = [range_start, range_end])
+		arr_df = pd.DataFrame({'proportion': arr_hist / np.sum(arr_hist),
+							   'left': edges[:-1], 'right': edges[1:]})
+		arr_df['f_proportion'] = ['%0.5f' % proportion for proportion in arr_df['proportion']]
+		arr_df['f_interval'] = ['%d to %d minutes' % (left, right) for left, right
+								in zip(arr_df['left'], arr_df['right'])]
+		arr_df['name'] = carrier_name
+		arr_df['color'] = colors[i]
+		frames.append(arr_df)
+
+	return pd.concat(frames).sort_values(['name', 'left'])
+
+# Best of several runs in milliseconds
+def best_time(function, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - start)
+	return 1000 * min(times)
+
+def run(rows_list, carriers_list, repeat):
+	results = []
+	for n_rows in rows_list:
+		flights = make_flights(n_rows, n_carriers=max(carriers_list))
+		index = FlightIndex(flights)
+		cube = DelayCube(index)
+
+		for n_carriers in carriers_list:
+			carrier_list = index.carriers[:n_carriers]
+			colors = ['#%06x' % i for i in range(n_carriers)]
+			args = (carrier_list, colors, -60, 120, 5)
+
+			# Both paths must agree before their timings mean anything
+			expected = loop_histograms(flights, *args)
+			for got in (carrier_histograms(index, *args),
+						carrier_histograms(index, *args, cube = cube)):
+				assert np.allclose(expected['proportion'].values, got['proportion'], equal_nan=True)
+				assert np.allclose(expected['left'].values, got['left'])
+
+			results.append({
+				'rows': n_rows, 'carriers': n_carriers,
+				'loop_ms': round(best_time(lambda: loop_histograms(flights, *args), repeat), 3),
+				'engine_ms': round(best_time(lambda: carrier_histograms(index, *args), repeat), 3),
+				'cube_ms': round(best_time(lambda: carrier_histograms(index, *args, cube = cube), repeat), 3)})
+
+			print('%10d rows %3d carriers   loop %9.2f ms   engine %8.2f ms   cube %6.2f ms' % (
+				n_rows, n_carriers, results[-1]['loop_ms'], results[-1]['engine_ms'],
+				results[-1]['cube_ms']))
+
+	return results
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(
+		description = 'Histogram update latency by carrier and row count')
+	parser.add_argument('--rows', type = int, nargs = '+', default = [100000, 1000000])
+	parser.add_argument('--carriers', type = int, nargs = '+', default = [1, 2, 4, 8, 16])
+	parser.add_argument('--repeat', type = int, default = 3)
+	parser.add_argument('--json', help = 'write the results to this file')
+	args = parser.parse_args()
+
+	results = run(args.rows, args.carriers, args.repeat)
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent = 2)
@@ -0,0 +1,104 @@
+# Import time of the app, per module, against a startup budget
+#
+# Runs a fresh interpreter with python -X importtime that imports what a
+# server process imports before it can take sessions (server_lifecycle.py
+# and the modules of main.py) and then loads the data, like
+# on_server_loaded. Prints the app's own modules, the slowest modules
+# overall and the total, and exits with status 1 when the imports or the
+# whole startup go over budget, so it can run in CI.
+#
+# Run from the bokeh_app directory:
+#     python -m benchmarks.import_time [--budget-ms 2000] [--load-budget-ms 3000]
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+# Modules imported by server_lifecycle.py and main.py
+APP_MODULES = ['scripts.registry', 'scripts.ingest', 'scripts.lazy', 'scripts.geometry',
+			   'scripts.histogram', 'scripts.density', 'scripts.table',
+			   'scripts.draw_map', 'scripts.routes']
+
+# Imports the app modules, then loads the data and the state outlines
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+%s
+imported = time.perf_counter()
+if %r:
+	from scripts.registry import read_datasets
+	from scripts.geometry import contiguous_states
+	read_datasets()
+	contiguous_states()
+loaded = time.perf_counter()
+sys.stdout.write(json.dumps({'import_ms': 1000 * (imported - start),
+							 'load_ms': 1000 * (loaded - imported)}))
+'''
+
+# [(module, self us, cumulative us, depth)] from -X importtime output
+def parse_importtime(stderr):
+	modules = []
+	for line in stderr.splitlines():
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		self_us, cumulative_us, name = line[len('import time:'):].split('|')
+		depth = (len(name) - len(name.lstrip())) // 2
+		modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+	return modules
+
+def run(load = True):
+	imports = '\n'.join('import %s' % module for module in APP_MODULES)
+	start = time.perf_counter()
+	child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD % (imports, load)],
+						   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+						   universal_newlines=True, check=True)
+	wall_ms = 1000 * (time.perf_counter() - start)
+
+	timings = json.loads(child.stdout)
+	modules = parse_importtime(child.stderr)
+
+	return {'wall_ms': round(wall_ms, 1),
+			'import_ms': round(timings['import_ms'], 1),
+			'load_ms': round(timings['load_ms'], 1),
+			'app_modules': {name: round(cumulative / 1000, 1) for name, _, cumulative, _
+							in modules if name in APP_MODULES},
+			'slowest_modules': [{'module': name, 'self_ms': round(self_us / 1000, 1),
+								 'cumulative_ms': round(cumulative / 1000, 1)}
+								for name, self_us, cumulative, _ in
+								sorted(modules, key=lambda module: -module[1])[:15]]}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Import time of the app against a budget')
+	parser.add_argument('--budget-ms', type = float, default = 2000,
+						help = 'budget for importing the app modules')
+	parser.add_argument('--load-budget-ms', type = float, default = 3000,
+						help = 'budget for importing and loading the data')
+	parser.add_argument('--no-load', action = 'store_true', help = 'only time the imports')
+	parser.add_argument('--json', help = 'write the report to this file')
+	args = parser.parse_args()
+
+	report = run(load = not args.no_load)
+
+	print('App modules (cumulative ms, in import order):')
+	for name, ms in report['app_modules'].items():
+		print('  %-22s %8.1f' % (name, ms))
+	print('Slowest modules (self ms):')
+	for module in report['slowest_modules']:
+		print('  %-40s %8.1f' % (module['module'], module['self_ms']))
+	print('Imports %.0f ms (budget %.0f), imports and data load %.0f ms (budget %.0f), '
+		  'process %.0f ms' % (report['import_ms'], args.budget_ms,
+							   report['import_ms'] + report['load_ms'], args.load_budget_ms,
+							   report['wall_ms']))
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(report, f, indent = 2)
+
+	over = report['import_ms'] > args.budget_ms
+	if not args.no_load:
+		over = over or report['import_ms'] + report['load_ms'] > args.load_budget_ms
+	if over:
+		print('Over budget')
+		sys.exit(1)
@@ -0,0 +1,431 @@
+# Headless load test of a running app over the bokeh websocket protocol
+#
+# Each simulated user opens a session the way the browser does (a
+# websocket with a new session id, then pulling the document), keeps a
+# client copy of the document up to date with the server's patches and
+# replays a script of widget interactions on it: toggling
+# carrier_selection, dragging range_select in steps (ending with
+# value_throttled like a real drag), switching tabs and picking a route
+# with the Selects. Every change is sent as a PATCH-DOC message, like
+# BokehJS sends it.
+#
+# An interaction's latency runs from its last change being sent to the
+# last update the server sends back for it, which includes the debounce
+# of the scheduler. Its bytes are everything the server sent from its
+# first change until the updates settle. Users open a new session after
+# finishing their script, so stages measure session opens as well.
+#
+# The load is run in stages of a growing number of concurrent users. For
+# each stage it prints sessions and interactions per second, latency
+# percentiles, bytes per interaction and, when the server's pid is known,
+# its CPU and memory (Linux). The saturation point of a server process is
+# where throughput stops growing while latency climbs. One load test
+# process can drive a few hundred users; when its own CPU (gen cpu) gets
+# close to 100% run several of them.
+#
+# Start the server (bokeh serve bokeh_app) and run from the bokeh_app
+# directory:
+#     python -m benchmarks.load_test --pid <server pid> --users 1 5 10 20 40
+# or let the load test start a server of its own with --launch.
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import time
+
+import numpy as np
+
+from bokeh.document import Document
+from bokeh.models.widgets import CheckboxGroup, RangeSlider, Select, Slider
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from bokeh.util.session_id import generate_session_id
+from tornado.websocket import websocket_connect
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+protocol = Protocol('1.0')
+
+# Patch events changing the data of a source
+DATA_EVENTS = ('ColumnsPatched', 'ColumnsStreamed', 'ColumnDataChanged')
+
+class SessionClosed(Exception):
+	pass
+
+# One simulated browser session
+class Session(object):
+
+	def __init__(self, url, settle, timeout):
+		self.url = url
+		self.settle = settle
+		self.timeout = timeout
+
+		self.doc = Document()
+		self.doc.on_change(self.changed)
+		self.events = []
+
+		# (msgtype, arrival time, bytes) of every message from the server
+		self.inbox = asyncio.Queue()
+		self.connection = None
+		self.reader = None
+
+	async def open(self):
+		url = '%s/ws?bokeh-protocol-version=1.0&bokeh-session-id=%s' % (
+			self.url.replace('http', 'ws', 1), generate_session_id())
+		self.connection = await websocket_connect(url)
+		self.reader = asyncio.ensure_future(self.read())
+
+		await self.expect('ACK')
+		await self.send(protocol.create('PULL-DOC-REQ'))
+		reply = await self.expect('PULL-DOC-REPLY')
+		reply.push_to_document(self.doc)
+
+		# Adding the server's models to the client document is no change
+		self.events = []
+
+	def close(self):
+		if self.reader is not None:
+			self.reader.cancel()
+		if self.connection is not None:
+			self.connection.close()
+
+	# Assemble the server's messages, applying document patches to the
+	# client document
+	async def read(self):
+		receiver = Receiver(protocol)
+		size = 0
+		while True:
+			fragment = await self.connection.read_message()
+			if fragment is None:
+				await self.inbox.put(('CLOSED', time.time(), 0, None))
+				return
+
+			size += len(fragment.encode('utf-8') if isinstance(fragment, str) else fragment)
+			message = await receiver.consume(fragment)
+			if message is None:
+				continue
+
+			if message.msgtype == 'PATCH-DOC':
+				self.apply(message)
+			await self.inbox.put((message.msgtype, time.time(), size, message))
+			size = 0
+
+	# Apply a document patch, except for changes of source data: only the
+	# widgets and layout are needed to interact with the document, and the
+	# python document cannot apply binary array patches
+	def apply(self, message):
+		events = [event for event in message.content['events']
+				  if event['kind'] not in DATA_EVENTS and event.get('attr') != 'data']
+		self.doc.apply_json_patch(dict(message.content, events = events), self)
+
+	async def next_message(self, timeout):
+		item = await asyncio.wait_for(self.inbox.get(), timeout)
+		if item[0] == 'CLOSED':
+			raise SessionClosed()
+		return item
+
+	async def expect(self, msgtype):
+		while True:
+			kind, _, _, message = await self.next_message(self.timeout)
+			if kind == msgtype:
+				return message
+			if kind == 'ERROR':
+				raise RuntimeError(message.content['text'])
+
+	async def send(self, message):
+		for fragment in (message.header_json, message.metadata_json, message.content_json):
+			await self.connection.write_message(fragment)
+
+	# Changes made to the client document, other than the server's patches
+	def changed(self, event):
+		if getattr(event, 'setter', None) is not self:
+			self.events.append(event)
+
+	# Make changes to the document [(model, attr, value)] pause seconds
+	# apart and wait for the server's updates to settle. Returns the
+	# latency (None without an update after the last change) and the bytes
+	# received.
+	async def interact(self, changes, pause = 0):
+		received = 0
+		last_update = None
+
+		# Anything left over from before belongs to no interaction
+		while not self.inbox.empty():
+			self.inbox.get_nowait()
+
+		for i, (model, attr, value) in enumerate(changes):
+			if i:
+				await asyncio.sleep(pause)
+			setattr(model, attr, value)
+			events, self.events = self.events, []
+			if events:
+				await self.send(protocol.create('PATCH-DOC', events, use_buffers=False))
+		sent = time.time()
+
+		# The first update can take long, the rest follow closely
+		wait = self.timeout
+		while True:
+			try:
+				kind, arrival, size, _ = await self.next_message(wait)
+			except asyncio.TimeoutError:
+				break
+			received += size
+			if kind == 'PATCH-DOC':
+				last_update = arrival
+				wait = self.settle
+
+		latency = last_update - sent if last_update is not None and last_update >= sent else None
+		return latency, received
+
+# Models of the client document
+def panel(doc, title):
+	tabs = doc.roots[0]
+	return tabs, next(panel for panel in tabs.tabs if panel.title == title)
+
+def find(model, type, **attrs):
+	return [found for found in model.select({'type': type})
+			if all(getattr(found, name) == value for name, value in attrs.items())]
+
+def carrier_toggle(rng, widget):
+	active = list(widget.active)
+	choice = int(rng.randint(len(widget.labels)))
+	active = [i for i in active if i != choice] if choice in active else active + [choice]
+	return [(widget, 'active', sorted(active) or [choice])]
+
+# A drag of a range slider's start in steps, ending with value_throttled
+def range_drag(rng, widget, steps):
+	start, end = widget.value
+	target = float(rng.uniform(widget.start, end - 10 * widget.step))
+	values = [(start + (target - start) * (i + 1) / steps, end) for i in range(steps)]
+	changes = [(widget, 'value', value) for value in values]
+	if 'value_throttled' in widget.properties():
+		changes.append((widget, 'value_throttled', values[-1]))
+	return changes
+
+# Widget interactions of one user: (name, function returning the changes
+# given the session's document), run in order
+def script(rng, args):
+	def histogram_carriers(doc):
+		return carrier_toggle(rng, find(panel(doc, 'Histogram')[1], CheckboxGroup)[0])
+
+	def histogram_range(doc):
+		return range_drag(rng, find(panel(doc, 'Histogram')[1], RangeSlider)[0], args.drag_steps)
+
+	def histogram_bins(doc):
+		slider = find(panel(doc, 'Histogram')[1], Slider)[0]
+		return [(slider, 'value', int(rng.randint(slider.start, slider.end + 1)))]
+
+	def show(title):
+		def change(doc):
+			tabs, shown = panel(doc, title)
+			return [(tabs, 'active', tabs.tabs.index(shown))]
+		return change
+
+	def density_carriers(doc):
+		return carrier_toggle(rng, find(panel(doc, 'Density Plot')[1], CheckboxGroup)[0])
+
+	def density_range(doc):
+		return range_drag(rng, find(panel(doc, 'Density Plot')[1], RangeSlider)[0],
+						  args.drag_steps)
+
+	def map_carriers(doc):
+		return carrier_toggle(rng, find(panel(doc, 'Flight Map')[1], CheckboxGroup)[0])
+
+	def route_origin(doc):
+		select = find(panel(doc, 'Route Details')[1], Select, title = 'Origin')[0]
+		return [(select, 'value', select.options[rng.randint(len(select.options))])]
+
+	def route_destination(doc):
+		select = find(panel(doc, 'Route Details')[1], Select, title = 'Destination')[0]
+		if not select.options:
+			return []
+		return [(select, 'value', select.options[rng.randint(len(select.options))])]
+
+	return [('histogram.carriers', histogram_carriers),
+			('histogram.range', histogram_range),
+			('histogram.bins', histogram_bins),
+			('tab.density', show('Density Plot')),
+			('density.carriers', density_carriers),
+			('density.range', density_range),
+			('tab.map', show('Flight Map')),
+			('map.carriers', map_carriers),
+			('tab.route', show('Route Details')),
+			('route.origin', route_origin),
+			('route.destination', route_destination),
+			('tab.table', show('Summary Table'))]
+
+# Results of one stage
+class Stage(object):
+
+	def __init__(self):
+		self.session_seconds = []
+		self.latencies = {}
+		self.bytes = []
+		self.no_update = 0
+		self.errors = 0
+
+	def record(self, name, latency, received):
+		self.bytes.append(received)
+		if latency is None:
+			self.no_update += 1
+		else:
+			self.latencies.setdefault(name, []).append(latency)
+
+	def all_latencies(self):
+		return [latency for latencies in self.latencies.values() for latency in latencies]
+
+# Open sessions and run the script until the stage ends
+async def user(args, stage, deadline, seed):
+	rng = np.random.RandomState(seed)
+	drag_pause = args.drag_ms / 1000
+
+	while time.time() < deadline:
+		session = Session(args.url, args.settle_ms / 1000, args.timeout)
+		try:
+			start = time.time()
+			await session.open()
+			stage.session_seconds.append(time.time() - start)
+
+			for name, changes in script(rng, args):
+				await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_ms / 1000)
+				if time.time() >= deadline:
+					break
+				latency, received = await session.interact(changes(session.doc), drag_pause)
+				stage.record(name, latency, received)
+		except (SessionClosed, RuntimeError, IOError, asyncio.TimeoutError):
+			stage.errors += 1
+		finally:
+			session.close()
+
+# CPU seconds and resident memory (bytes) of a process and its children
+def process_usage(pid):
+	pids = [pid]
+	try:
+		with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+			pids += [int(child) for child in f.read().split()]
+	except IOError:
+		pass
+
+	cpu = rss = 0
+	for process in pids:
+		with open('/proc/%d/stat' % process) as f:
+			fields = f.read().rsplit(')', 1)[1].split()
+		cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+		rss += int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+	return cpu, rss
+
+def percentile(values, q):
+	return 1000 * float(np.percentile(values, q)) if values else float('nan')
+
+async def run_stage(args, n_users):
+	stage = Stage()
+	start = time.time()
+	cpu_start = process_usage(args.pid)[0] if args.pid else None
+	gen_start = time.process_time()
+
+	await asyncio.gather(*[user(args, stage, start + args.duration, seed)
+						   for seed in range(n_users)])
+
+	elapsed = time.time() - start
+	latencies = stage.all_latencies()
+	result = {'users': n_users, 'seconds': round(elapsed, 2),
+			  'sessions_per_second': round(len(stage.session_seconds) / elapsed, 2),
+			  'interactions_per_second': round(len(stage.bytes) / elapsed, 2),
+			  'session_open_p50_ms': round(percentile(stage.session_seconds, 50), 1),
+			  'latency_p50_ms': round(percentile(latencies, 50), 1),
+			  'latency_p90_ms': round(percentile(latencies, 90), 1),
+			  'latency_p99_ms': round(percentile(latencies, 99), 1),
+			  'latency_p99_ms_by_interaction': {name: round(percentile(values, 99), 1)
+												for name, values in sorted(stage.latencies.items())},
+			  'kb_per_interaction': round(np.mean(stage.bytes) / 1024, 1) if stage.bytes else 0,
+			  'no_update': stage.no_update, 'errors': stage.errors,
+			  'generator_cpu': round(100 * (time.process_time() - gen_start) / elapsed, 1)}
+
+	if args.pid:
+		cpu, rss = process_usage(args.pid)
+		result['server_cpu'] = round(100 * (cpu - cpu_start) / elapsed, 1)
+		result['server_rss_mb'] = round(rss / 2 ** 20, 1)
+
+	return result
+
+async def main(args):
+	print('%6s %10s %10s %9s %9s %9s %10s %9s %9s %9s %7s' % (
+		'users', 'sessions/s', 'actions/s', 'p50 ms', 'p90 ms', 'p99 ms', 'KB/action',
+		'srv cpu', 'srv MB', 'gen cpu', 'errors'))
+
+	results = []
+	for n_users in args.users:
+		result = await run_stage(args, n_users)
+		results.append(result)
+		print('%6d %10.2f %10.2f %9.1f %9.1f %9.1f %10.1f %8s%% %9s %8.1f%% %7d' % (
+			n_users, result['sessions_per_second'], result['interactions_per_second'],
+			result['latency_p50_ms'], result['latency_p90_ms'], result['latency_p99_ms'],
+			result['kb_per_interaction'], result.get('server_cpu', '-'),
+			result.get('server_rss_mb', '-'), result['generator_cpu'], result['errors']))
+
+	return results
+
+# Start bokeh serve on the port and wait for it to take sessions
+def launch(port):
+	server = subprocess.Popen(['bokeh', 'serve', APP_DIR, '--port', str(port)],
+							  stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+
+	async def ready():
+		for _ in range(120):
+			try:
+				session = Session('http://localhost:%d/%s' % (port, os.path.basename(APP_DIR)),
+								  0.1, 10)
+				await session.open()
+				session.close()
+				return
+			except (IOError, OSError):
+				await asyncio.sleep(0.5)
+		raise RuntimeError('The server did not start')
+
+	asyncio.run(ready())
+	return server
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Headless load test of the app')
+	parser.add_argument('--url', default = None,
+						help = 'app url (default: http://localhost:<port>/bokeh_app)')
+	parser.add_argument('--port', type = int, default = 5006)
+	parser.add_argument('--launch', action = 'store_true',
+						help = 'start bokeh serve on the port for the test')
+	parser.add_argument('--pid', type = int, default = None,
+						help = 'server process to measure the CPU and memory of')
+	parser.add_argument('--users', type = int, nargs = '+', default = [1, 5, 10, 20, 40],
+						help = 'concurrent users of each stage')
+	parser.add_argument('--duration', type = float, default = 30,
+						help = 'seconds each stage runs')
+	parser.add_argument('--think-ms', type = float, default = 500,
+						help = 'mean pause between interactions')
+	parser.add_argument('--drag-steps', type = int, default = 8)
+	parser.add_argument('--drag-ms', type = float, default = 30,
+						help = 'pause between the steps of a drag')
+	parser.add_argument('--settle-ms', type = float, default = 300,
+						help = 'quiet time after which an interaction is done')
+	parser.add_argument('--timeout', type = float, default = 10,
+						help = 'seconds to wait for a reply before giving up')
+	parser.add_argument('--json', help = 'write the results to this file')
+	args = parser.parse_args()
+
+	args.url = args.url or 'http://localhost:%d/%s' % (args.port, os.path.basename(APP_DIR))
+
+	server = None
+	if args.launch:
+		server = launch(args.port)
+		args.pid = server.pid
+
+	try:
+		results = asyncio.run(main(args))
+	finally:
+		if server is not None:
+			server.terminate()
+			server.wait()
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump({'args': vars(args), 'results': results}, f, indent = 2)
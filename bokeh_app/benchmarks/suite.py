@@ -0,0 +1,209 @@
+# Scaling benchmarks of every tab's data preparation and initial build
+#
+# For each size, synthetic flights (benchmarks/synthetic.py) are indexed
+# like the registry does and every data path the tabs use is timed: the
+# shared structures built at load, each tab's dataset function (the
+# closures in the tab modules only call these) and building each tab from
+# scratch into a new document. Each case records its best time over the
+# repeats and, in a separate run under tracemalloc, its peak memory.
+#
+# Results are written as JSON and two result files can be compared, which
+# exits with status 1 when a case got slower than the threshold. Nothing
+# here needs a browser.
+#
+# Run from the bokeh_app directory:
+#     python -m benchmarks.suite --rows 10000 1000000 --json before.json
+#     python -m benchmarks.suite --compare before.json after.json
+
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import bokeh
+from bokeh.document import Document
+from bokeh.io.doc import set_curdoc
+
+from scripts.binning import DelayCube, carrier_histograms
+from scripts.build_map import aggregate, merge, route_columns
+from scripts.cache import dataset_cache
+from scripts.geometry import contiguous_states
+from scripts.index import FlightIndex
+from scripts.kde import binned_density, curve_cache, exact_density
+from scripts.registry import Datasets
+from scripts.route_table import MAP_COLUMNS, RouteTable
+from scripts.routes import route_dataset
+from scripts.stats import CarrierStats
+from benchmarks.synthetic import make_airports, make_flights
+
+# Best time (ms) over repeat runs and the result of the last run
+def best_time(function, repeat):
+	times = []
+	for _ in range(repeat):
+		gc.collect()
+		start = time.perf_counter()
+		result = function()
+		times.append(time.perf_counter() - start)
+	return 1000 * min(times), result
+
+# Peak memory (MB) allocated while the function runs
+def peak_memory(function):
+	gc.collect()
+	tracemalloc.start()
+	try:
+		function()
+		return tracemalloc.get_traced_memory()[1] / 2 ** 20
+	finally:
+		tracemalloc.stop()
+
+# Route table of the map for the synthetic flights
+def make_routes(flights, airports):
+	chunk = flights.assign(year=2013, month=1, distance=1000.0)
+	columns = route_columns(merge([aggregate(chunk)[0]]), airports.set_index('IATA'))
+	return RouteTable(pd.DataFrame({name: columns[name] for name in MAP_COLUMNS.values()}))
+
+# Build a tab into a new document, as the first session would
+def build_tab(factory):
+	set_curdoc(Document())
+	curve_cache.clear()
+	dataset_cache.clear()
+	return factory()
+
+def run_size(n_rows, args):
+	from scripts.histogram import histogram_tab
+	from scripts.density import density_tab
+	from scripts.table import table_tab
+	from scripts.draw_map import map_tab
+	from scripts.routes import route_tab
+
+	flights = make_flights(n_rows, n_carriers=args.carriers, n_airports=args.airports,
+						   distribution=args.distribution, categorical=True)
+	airports = make_airports(args.airports)
+	states = contiguous_states()
+
+	results = []
+
+	def case(name, function):
+		ms, result = best_time(function, args.repeat)
+		peak_mb = None if args.no_memory else round(peak_memory(function), 2)
+		results.append({'case': name, 'rows': n_rows, 'carriers': args.carriers,
+						'airports': args.airports, 'distribution': args.distribution,
+						'ms': round(ms, 3), 'peak_mb': peak_mb})
+		print('%10d rows  %-20s %10.2f ms %s' % (
+			n_rows, name, ms, '' if peak_mb is None else '%10.1f MB peak' % peak_mb))
+		return result
+
+	# Shared structures built once per process at load time
+	index = case('build.index', lambda: FlightIndex(flights))
+	cube = case('build.cube', lambda: DelayCube(index))
+	stats = case('build.stats', lambda: CarrierStats.from_index(index))
+	routes = case('build.routes', lambda: make_routes(flights, airports))
+
+	carrier_list = index.carriers[:4]
+	colors = ['#%06x' % (i * 0x203040) for i in range(len(carrier_list))]
+	x = np.linspace(-60, 120, 100)
+
+	# Each tab's dataset for its default widgets
+	case('histogram.engine', lambda: carrier_histograms(
+		index, carrier_list, colors, -60, 120, 5))
+	case('histogram.cube', lambda: carrier_histograms(
+		index, carrier_list, colors, -60, 120, 5, cube = cube))
+	case('density.binned', lambda: [binned_density(index, cube, carrier, -60, 120, None, x)
+									for carrier in carrier_list])
+	if n_rows <= args.exact_max_rows:
+		case('density.exact', lambda: [exact_density(index, cube, carrier, -60, 120, None, x)
+									   for carrier in carrier_list])
+	case('table.stats', lambda: stats.table())
+	case('map.select', lambda: routes.select(carrier_list, dict(zip(carrier_list, colors))))
+	case('route.full', lambda: route_dataset(index, 'JFK', 'MIA'))
+	case('route.zoomed', lambda: route_dataset(index, 'JFK', 'MIA', window = (0, 10)))
+
+	# Building each tab for a new session
+	datasets = Datasets(flights, routes, 0.0, index)
+
+	case('tab.histogram', lambda: build_tab(lambda: histogram_tab(datasets)))
+	case('tab.density', lambda: build_tab(lambda: density_tab(datasets)))
+	case('tab.table', lambda: build_tab(lambda: table_tab(datasets)))
+	case('tab.map', lambda: build_tab(lambda: map_tab(routes, states)))
+	case('tab.route', lambda: build_tab(lambda: route_tab(datasets)))
+
+	return results
+
+def meta():
+	try:
+		commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+										 universal_newlines=True).strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+
+	return {'commit': commit, 'python': platform.python_version(),
+			'numpy': np.__version__, 'pandas': pd.__version__, 'bokeh': bokeh.__version__,
+			'machine': platform.machine(), 'processor': platform.processor(),
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+# Print the ratio of new to old time for every case in both files, and
+# whether any case got slower than the threshold
+def compare(old_path, new_path, threshold):
+	with open(old_path) as f:
+		old = json.load(f)
+	with open(new_path) as f:
+		new = json.load(f)
+
+	old_ms = {(result['case'], result['rows']): result['ms'] for result in old['results']}
+	regressions = 0
+
+	print('%-20s %10s %12s %12s %8s' % ('case', 'rows', 'old ms', 'new ms', 'ratio'))
+	for result in new['results']:
+		key = (result['case'], result['rows'])
+		if key not in old_ms:
+			continue
+
+		ratio = result['ms'] / old_ms[key] if old_ms[key] else float('inf')
+		slower = ratio > threshold
+		regressions += slower
+		print('%-20s %10d %12.2f %12.2f %7.2fx%s' % (
+			result['case'], result['rows'], old_ms[key], result['ms'], ratio,
+			'  slower' if slower else ''))
+
+	print('%s (%s) against %s (%s): %d cases slower than %.2fx' % (
+		new_path, new['meta']['commit'], old_path, old['meta']['commit'],
+		regressions, threshold))
+	return regressions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Scaling benchmarks of the tabs')
+	parser.add_argument('--rows', type = int, nargs = '+', default = [10000, 100000, 1000000],
+						help = 'row counts to run (synthetic data handles up to 50M)')
+	parser.add_argument('--carriers', type = int, default = 16)
+	parser.add_argument('--airports', type = int, default = 100)
+	parser.add_argument('--distribution', default = 'gamma',
+						choices = ['gamma', 'normal', 'uniform'], help = 'delay distribution')
+	parser.add_argument('--repeat', type = int, default = 3)
+	parser.add_argument('--exact-max-rows', type = int, default = 1000000,
+						help = 'largest size to run the exact (scipy) density engine on')
+	parser.add_argument('--no-memory', action = 'store_true',
+						help = 'skip the tracemalloc runs for peak memory')
+	parser.add_argument('--json', help = 'write the results to this file')
+	parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'),
+						help = 'compare two result files instead of running')
+	parser.add_argument('--threshold', type = float, default = 1.2,
+						help = 'ratio of new to old time counted as slower')
+	args = parser.parse_args()
+
+	if args.compare:
+		sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+	results = []
+	for n_rows in args.rows:
+		results.extend(run_size(n_rows, args))
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump({'meta': meta(), 'results': results}, f, indent = 2)
@@ -0,0 +1,63 @@
+# Synthetic flights data for benchmarks (no real data needed)
+
+import numpy as np
+import pandas as pd
+
+# Real airport codes come first so the tabs' default route (JFK to MIA)
+# exists in the synthetic data, the rest are made up
+REAL_AIRPORTS = ['JFK', 'EWR', 'LGA', 'MIA', 'ATL', 'ORD', 'LAX', 'SFO']
+
+# Integer minute delays drawn from a few distributions
+def make_delays(rng, n_rows, distribution='gamma'):
+	# Long right tail like real arrival delays
+	if distribution == 'gamma':
+		return np.round(rng.gamma(1.5, 20, size=n_rows) - 30)
+	elif distribution == 'normal':
+		return np.round(rng.normal(5, 40, size=n_rows))
+	elif distribution == 'uniform':
+		return np.round(rng.uniform(-60, 180, size=n_rows))
+
+	raise ValueError('Unknown delay distribution: %s' % distribution)
+
+def airport_codes(n_airports):
+	return np.array((REAL_AIRPORTS + ['A%03d' % i for i in range(n_airports)])[:n_airports],
+					dtype=object)
+
+# Frame with the columns the tabs use: arr_delay, name, origin and dest.
+# With categorical the names and airports are stored as codes like the
+# loader does, which keeps 50M rows in about 500 MB.
+def make_flights(n_rows, n_carriers=16, n_airports=100, seed=0,
+				 distribution='gamma', categorical=False):
+	rng = np.random.RandomState(seed)
+
+	carriers = np.array(['Carrier %02d' % i for i in range(n_carriers)], dtype=object)
+	airports = airport_codes(n_airports)
+
+	# Skewed carrier sizes like the real data, a few big and many small
+	weights = 1.0 / np.arange(1, n_carriers + 1)
+	carrier_codes = rng.choice(n_carriers, size=n_rows, p=weights / weights.sum()).astype(np.int16)
+
+	# Most flights leave from a handful of origin airports
+	origin_codes = rng.randint(0, min(3, n_airports), size=n_rows).astype(np.int16)
+	dest_codes = rng.randint(0, n_airports, size=n_rows).astype(np.int16)
+
+	delays = make_delays(rng, n_rows, distribution)
+
+	if categorical:
+		return pd.DataFrame({'arr_delay': delays.astype(np.float32),
+							 'name': pd.Categorical.from_codes(carrier_codes, carriers),
+							 'origin': pd.Categorical.from_codes(origin_codes, airports),
+							 'dest': pd.Categorical.from_codes(dest_codes, airports)})
+
+	return pd.DataFrame({'arr_delay': delays,
+						 'name': carriers[carrier_codes],
+						 'origin': airports[origin_codes],
+						 'dest': airports[dest_codes]})
+
+# Coordinates for the airports of make_flights, somewhere in the
+# contiguous US
+def make_airports(n_airports=100, seed=0):
+	rng = np.random.RandomState(seed)
+	return pd.DataFrame({'IATA': airport_codes(n_airports),
+						 'Longitude': rng.uniform(-124, -68, size=n_airports),
+						 'Latitude': rng.uniform(26, 48, size=n_airports)})
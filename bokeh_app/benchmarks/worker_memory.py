@@ -0,0 +1,146 @@
+# Memory of the server's worker processes as the number of workers grows
+#
+# Starts serve.py with each --num-procs, opens a few sessions, and reads
+# every worker's memory from /proc/<pid>/smaps (Linux only):
+#
+#   - rss: resident memory, counting shared pages in full in every worker
+#   - pss: resident memory with shared pages split between the processes
+#     sharing them, the sum over the workers is what they use together
+#   - private: memory only this worker uses
+#   - data rss/pss/private: the same for the mapped flights and index cache
+#
+# With the cache mapped by every worker, data private stays near zero and
+# data pss shrinks as 1/N, so the workers' total grows by the private
+# memory of one more python process per worker and not by another copy of
+# the data.
+#
+# Run from the bokeh_app directory:
+#     python -m benchmarks.worker_memory --procs 1 2 4 8 [--json memory.json]
+
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+from bokeh.client import pull_session
+
+from scripts.registry import flights_cache_dir
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MAPPING = re.compile(r'^[0-9a-f]+-[0-9a-f]+ ')
+
+# Resident, proportional and private memory (kB) of a process, in total
+# and for the mappings of files under a directory
+def process_memory(pid, data_dir):
+	totals = {'rss': 0, 'pss': 0, 'private': 0,
+			  'data_rss': 0, 'data_pss': 0, 'data_private': 0}
+	in_data = False
+
+	with open('/proc/%d/smaps' % pid) as f:
+		for line in f:
+			if MAPPING.match(line):
+				fields = line.split(None, 5)
+				in_data = len(fields) == 6 and fields[5].strip().startswith(data_dir)
+				continue
+
+			key, _, value = line.partition(':')
+			if key not in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+				continue
+
+			name = 'private' if key.startswith('Private') else key.lower()
+			kb = int(value.split()[0])
+			totals[name] += kb
+			if in_data:
+				totals['data_' + name] += kb
+
+	return totals
+
+def children(pid):
+	try:
+		with open('/proc/%d/task/%d/children' % (pid, pid)) as f:
+			return [int(child) for child in f.read().split()]
+	except IOError:
+		return []
+
+# Whether a process has mapped the cache, i.e. it has loaded the datasets
+def loaded(pid, data_dir):
+	with open('/proc/%d/maps' % pid) as f:
+		return any(data_dir in line for line in f)
+
+# Processes serving the app, once every one of them has loaded the data
+def wait_for_workers(server, n_procs, port, data_dir, timeout):
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		if server.poll() is not None:
+			raise RuntimeError('serve.py exited with status %d' % server.returncode)
+
+		workers = [server.pid] if n_procs == 1 else children(server.pid)
+		try:
+			urllib.request.urlopen('http://localhost:%d/metrics' % port, timeout = 1).read()
+			if len(workers) == n_procs and all(loaded(pid, data_dir) for pid in workers):
+				return workers
+		except (IOError, OSError):
+			pass
+		time.sleep(0.5)
+
+	raise RuntimeError('%d workers did not load the data in %ds' % (n_procs, timeout))
+
+def measure(n_procs, args, data_dir):
+	server = subprocess.Popen([sys.executable, os.path.join(APP_DIR, 'serve.py'),
+							   '--port', str(args.port), '--num-procs', str(n_procs)],
+							  stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL,
+							  start_new_session = True)
+	try:
+		workers = wait_for_workers(server, n_procs, args.port, data_dir, args.timeout)
+
+		# Sessions land on whichever worker accepts them
+		for _ in range(args.sessions):
+			session = pull_session(url = 'http://localhost:%d/bokeh_app' % args.port)
+			session.close()
+		time.sleep(1)
+
+		return [process_memory(pid, data_dir) for pid in workers]
+	finally:
+		os.killpg(server.pid, signal.SIGTERM)
+		server.wait()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Memory of the workers by number of workers')
+	parser.add_argument('--procs', type = int, nargs = '+', default = [1, 2, 4, 8])
+	parser.add_argument('--sessions', type = int, default = 8,
+						help = 'sessions to open before measuring')
+	parser.add_argument('--port', type = int, default = 5160)
+	parser.add_argument('--timeout', type = int, default = 120)
+	parser.add_argument('--json', help = 'write the results to this file')
+	args = parser.parse_args()
+
+	data_dir = os.path.abspath(flights_cache_dir())
+	results = []
+
+	print('%6s %12s %12s %12s %12s %12s %12s %12s' % (
+		'procs', 'rss MB', 'pss MB', 'private MB', 'data rss', 'data pss',
+		'data private', 'total pss'))
+	for n_procs in args.procs:
+		workers = measure(n_procs, args, data_dir)
+
+		# Mean per worker, and the sum of pss over all of them
+		mean = {key: sum(worker[key] for worker in workers) / len(workers) / 1024
+				for key in workers[0]}
+		total_pss = sum(worker['pss'] for worker in workers) / 1024
+
+		print('%6d %12.1f %12.1f %12.1f %12.2f %12.2f %12.2f %12.1f' % (
+			n_procs, mean['rss'], mean['pss'], mean['private'], mean['data_rss'],
+			mean['data_pss'], mean['data_private'], total_pss))
+		results.append({'procs': n_procs, 'workers_kb': workers,
+						'mean_mb': {key: round(value, 2) for key, value in mean.items()},
+						'total_pss_mb': round(total_pss, 1)})
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent = 2)
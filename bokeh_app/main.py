@@ -1,12 +1,5 @@
-# Pandas for data management
-import pandas as pd
-
-# os methods for manipulating paths
-from os.path import dirname, join
-
 # Bokeh basics 
 from bokeh.io import curdoc
-from bokeh.models.widgets import Tabs
 
 
 # Each tab is drawn by one script
@@ -15,29 +8,25 @@ from scripts.density import density_tab
 from scripts.table import table_tab
 from scripts.draw_map import map_tab
 from scripts.routes import route_tab
+from scripts.lazy import LazyTabs
 
-# Using included state data from Bokeh for map
-from bokeh.sampledata.us_states import data as states
-
-# Read data into dataframes
-flights = pd.read_csv(join(dirname(__file__), 'data', 'flights.csv'), 
-	                                          index_col=0).dropna()
+# Datasets shared by every session in this server process
+from scripts.registry import get_datasets
 
-# Formatted Flight Delay Data for map
-map_data = pd.read_csv(join(dirname(__file__), 'data', 'flights_map.csv'),
-                            header=[0,1], index_col=0)
+# Outlines of the contiguous states for the map
+from scripts.geometry import contiguous_states
 
-# Create each of the tabs
-tab1 = histogram_tab(flights)
-tab2 = density_tab(flights)
-tab3 = table_tab(flights)
-tab4 = map_tab(map_data, states)
-tab5 = route_tab(flights)
+# Flights and formatted flight delay data for map, loaded once per process
+datasets = get_datasets()
+routes = datasets.routes
+states = contiguous_states()
 
-# Put all the tabs into one application
-tabs = Tabs(tabs = [tab1, tab2, tab3, tab4, tab5])
+# Each tab is built the first time it is shown
+tabs = LazyTabs([('Histogram', lambda: histogram_tab(datasets)),
+				 ('Density Plot', lambda: density_tab(datasets)),
+				 ('Summary Table', lambda: table_tab(datasets)),
+				 ('Flight Map', lambda: map_tab(routes, states)),
+				 ('Route Details', lambda: route_tab(datasets))])
 
 # Put the tabs in the current document for display
-curdoc().add_root(tabs)
-
-
+curdoc().add_root(tabs.tabs)
@@ -0,0 +1,194 @@
+# Vectorized histograms of arrival delays for many carriers at once
+#
+# Instead of one np.histogram call (and one DataFrame) per carrier, the
+# delays of all selected carriers are binned together: each row gets a
+# (carrier slot, bin) pair and a single bincount fills a 2-D counts matrix.
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from scripts import metrics
+
+# Bin edges used by the histogram tab (same as np.histogram with equal bins)
+def bin_edges(range_start, range_end, bin_width):
+	n_bins = max(int((range_end - range_start) / bin_width), 1)
+	return np.linspace(range_start, range_end, n_bins + 1)
+
+# Bin number of every value, -1 for values outside the edges. This follows
+# np.histogram exactly: bins are half open except the last one, which
+# includes the right edge.
+def bin_index(values, edges):
+	n_bins = len(edges) - 1
+	first, last = edges[0], edges[-1]
+
+	indices = np.full(len(values), -1, dtype=np.intp)
+	keep = (values >= first) & (values <= last)
+	kept = values[keep]
+
+	# Scale to bin numbers then correct for floating point rounding
+	found = ((kept - first) * (n_bins / (last - first))).astype(np.intp)
+	found[found == n_bins] -= 1
+	found[kept < edges[found]] -= 1
+	found[(kept >= edges[found + 1]) & (found != n_bins - 1)] += 1
+
+	indices[keep] = found
+	return indices
+
+# Counts matrix (groups x bins) for a list of arrays of delays
+def group_counts(groups, edges):
+	n_bins = len(edges) - 1
+
+	# All the delays with the position of their group in the list
+	delays = np.concatenate(list(groups) + [np.empty(0)])
+	slots = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+
+	bins = bin_index(delays, edges)
+	keep = bins >= 0
+
+	counts = np.bincount(slots[keep] * n_bins + bins[keep],
+						 minlength=len(groups) * n_bins)
+
+	return counts.reshape(len(groups), n_bins)
+
+# Counts matrix (carriers x bins) for the carriers in carrier_list
+def carrier_counts(index, carrier_list, edges):
+	return group_counts([index.carrier_delays(carrier) for carrier in carrier_list],
+						edges)
+
+# Divide each carrier's counts by its total to get proportions
+def proportions(counts, totals = None):
+	if totals is None:
+		totals = counts.sum(axis=1)
+	totals = np.asarray(totals).reshape(-1, 1)
+
+	# A carrier with no flights in range has undefined proportions (nan)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		return counts / totals
+
+# Quad columns for the histogram plot, one row per (carrier, bin), sorted
+# by carrier name then bin like the plot has always been. Numbers are
+# float32 arrays so bokeh sends them as binary, the tooltip formats them.
+def histogram_columns(carrier_list, colors, props, edges):
+	n_carriers, n_bins = props.shape
+
+	# Order of the carriers by name
+	order = np.argsort(np.asarray(carrier_list, dtype=object), kind='stable')
+
+	names = np.repeat(np.asarray(carrier_list, dtype=object)[order], n_bins)
+	carrier_colors = np.repeat(np.asarray(colors, dtype=object)[order], n_bins)
+
+	return {'proportion': props[order].ravel().astype(np.float32),
+			'left': np.tile(edges[:-1], n_carriers).astype(np.float32),
+			'right': np.tile(edges[1:], n_carriers).astype(np.float32),
+			'name': names, 'color': carrier_colors}
+
+# Full histogram dataset for a selection of carriers, read from the
+# prefix sums of the cube when one covers the range
+def carrier_histograms(index, carrier_list, colors, range_start, range_end,
+					   bin_width, cube = None):
+	edges = bin_edges(range_start, range_end, bin_width)
+	props = carrier_proportions(index, carrier_list, edges, cube)
+
+	return histogram_columns(carrier_list, colors, props, edges)
+
+# Proportions matrix (carriers x bins) for bins with the given edges
+def carrier_proportions(index, carrier_list, edges, cube = None):
+	range_start, range_end = edges[0], edges[-1]
+
+	if cube is not None and cube.covers(range_start, range_end):
+		metrics.rows_scanned.observe(0, tab = 'histogram')
+		return proportions(cube.counts(carrier_list, edges),
+						   cube.totals(carrier_list, range_start, range_end))
+
+	metrics.rows_scanned.observe(sum(len(index.carrier_delays(carrier))
+									 for carrier in carrier_list), tab = 'histogram')
+	return proportions(carrier_counts(index, carrier_list, edges))
+
+# Per carrier cumulative counts of the delays at 1 minute resolution
+#
+# Bucket 0 counts every delay below low, buckets 1 to (high - low + 1)
+# count the delays of each minute from low to high, and the last bucket
+# counts every delay above high. The cumulative sums have a leading zero
+# so the number of flights between two buckets is a difference of two
+# entries. A histogram for any range inside [low, high] and any bin width
+# then costs O(carriers x bins), however many flights there are.
+#
+# Delays are recorded in whole minutes so the cube gives exactly the
+# counts of np.histogram; fractional delays are counted in the minute
+# they fall in.
+class DelayCube(object):
+
+	def __init__(self, index, low = -60, high = 180):
+		self.low = int(low)
+		self.high = int(high)
+		self.carriers = list(index.carriers)
+		n_buckets = self.high - self.low + 3
+
+		# Carrier of every row in the carrier sorted index
+		codes = np.repeat(np.arange(len(self.carriers)), np.diff(index.carrier_offsets))
+
+		counts = np.bincount(codes * n_buckets + self.bucket(index.delays),
+							 minlength=len(self.carriers) * n_buckets)
+		counts = counts.reshape(len(self.carriers), n_buckets)
+
+		self.cumulative = np.zeros((len(self.carriers), n_buckets + 1), dtype=np.int64)
+		np.cumsum(counts, axis=1, out=self.cumulative[:, 1:])
+
+		self._rows = {carrier: i for i, carrier in enumerate(self.carriers)}
+
+	# New cube with the delays of new rows folded into the counts, carriers
+	# not seen before get a row of their own. This cube is left unchanged,
+	# compute threads may be reading it.
+	def added(self, names, delays):
+		cube = copy.copy(self)
+		cube.carriers = self.carriers + [carrier for carrier in pd.unique(names)
+										 if carrier not in self._rows]
+		cube._rows = {carrier: i for i, carrier in enumerate(cube.carriers)}
+
+		n_buckets = self.cumulative.shape[1] - 1
+		codes = pd.Index(cube.carriers).get_indexer(names)
+		counts = np.bincount(codes * n_buckets + self.bucket(delays),
+							 minlength=len(cube.carriers) * n_buckets)
+
+		cube.cumulative = np.zeros((len(cube.carriers), n_buckets + 1),
+								   dtype=self.cumulative.dtype)
+		cube.cumulative[:len(self.carriers)] = self.cumulative
+		cube.cumulative[:, 1:] += np.cumsum(counts.reshape(len(cube.carriers), n_buckets), axis=1)
+		return cube
+
+	# Bucket of each delay (values outside [low, high] go to the overflows)
+	def bucket(self, delays):
+		minutes = np.floor(delays)
+		return (np.clip(minutes, self.low - 1, self.high + 1) - self.low + 1).astype(np.intp)
+
+	# Whether a histogram range can be answered from the cube
+	def covers(self, range_start, range_end):
+		return self.low <= range_start and range_end <= self.high
+
+	# Counts matrix (carriers x bins) for bins with the given edges
+	def counts(self, carrier_list, edges):
+		rows = self.cumulative[[self._rows[carrier] for carrier in carrier_list]]
+
+		# Whole minutes in each half open bin [left, right)
+		first = (np.ceil(edges[:-1]) - self.low + 1).astype(np.intp)
+		after = (np.ceil(edges[1:]) - self.low + 1).astype(np.intp)
+
+		# The last bin also includes its right edge
+		after[-1] = int(np.floor(edges[-1])) - self.low + 2
+
+		return rows[:, after] - rows[:, first]
+
+	# Flights in each minute from first to last (inclusive) for one carrier
+	def minute_counts(self, carrier, first, last):
+		row = self.cumulative[self._rows[carrier]]
+		return np.diff(row[first - self.low + 1:last - self.low + 3])
+
+	# Flights with a delay in [range_start, range_end] for each carrier,
+	# the denominator of the histogram proportions
+	def totals(self, carrier_list, range_start, range_end):
+		rows = self.cumulative[[self._rows[carrier] for carrier in carrier_list]]
+		first = int(np.ceil(range_start)) - self.low + 1
+		after = int(np.floor(range_end)) - self.low + 2
+		return rows[:, after] - rows[:, first]
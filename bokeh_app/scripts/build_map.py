@@ -0,0 +1,231 @@
+# Build the route table of the flight map from the raw flights
+#
+# flights_map.csv was made by hand in flight_map_development.ipynb. This
+# builds the same routes (one row per origin, destination and carrier with
+# the count, mean, min and max arrival delay and the mean distance) from
+# the command line:
+#
+#   - the flights csv is read in chunks of the needed columns only
+#   - each chunk is aggregated in a worker process into a partial with
+#     counts, sums, mins and maxes, which merge into the same totals in any
+#     order
+#   - airport coordinates are joined with an index lookup on the airport
+#     codes, routes to airports without coordinates (outside the
+#     contiguous US) are dropped like in the notebook
+#   - the result is written as flat typed columns to an .npz file which
+#     RouteTable.load reads directly
+#
+# The artifact keeps the partials of the months before the latest one in
+# the file and the months they cover. Running the build again first reads
+# only the year and month of every row, then parses just the rows of
+# months that are not in the artifact, skipping the others by line number.
+# The latest month may still be getting flights, so it is never marked
+# built and is read again by every build. Use --full to rebuild from
+# scratch when rows of old months change.
+#
+# Run from the bokeh_app directory:
+#     python -m scripts.build_map [--flights data/flights.csv] [--jobs 4]
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.registry import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+ROUTE_KEYS = ['origin', 'dest', 'carrier']
+
+# Columns of the raw flights file used by the build
+RAW_COLUMNS = ['year', 'month', 'origin', 'dest', 'name', 'arr_delay', 'distance']
+
+# Mergeable partial aggregates of a route and how to merge each one
+PARTIALS = {'count': 'sum', 'delay_sum': 'sum', 'min_delay': 'min',
+			'max_delay': 'max', 'distance_count': 'sum', 'distance_sum': 'sum'}
+
+PARTIAL_TYPES = {'count': np.int64, 'delay_sum': np.float64,
+				 'min_delay': np.float64, 'max_delay': np.float64,
+				 'distance_count': np.int64, 'distance_sum': np.float64}
+
+# Partial aggregates of one chunk of flights
+def aggregate(chunk):
+	chunk = chunk.rename(columns={'name': 'carrier'})
+	grouped = chunk.groupby(ROUTE_KEYS, sort=False, observed=True)
+
+	partial = pd.DataFrame({'count': grouped['arr_delay'].count(),
+							'delay_sum': grouped['arr_delay'].sum(),
+							'min_delay': grouped['arr_delay'].min(),
+							'max_delay': grouped['arr_delay'].max(),
+							'distance_count': grouped['distance'].count(),
+							'distance_sum': grouped['distance'].sum()})
+
+	months = np.unique(chunk['year'].values * 100 + chunk['month'].values)
+	return partial, months
+
+# Merge partials (any number, in any order) into one
+def merge(partials):
+	partials = [partial for partial in partials if len(partial)]
+	if not partials:
+		keys = pd.MultiIndex.from_arrays([np.array([], dtype=object)] * len(ROUTE_KEYS),
+										 names=ROUTE_KEYS)
+		return pd.DataFrame({name: np.array([], dtype=dtype)
+							 for name, dtype in PARTIAL_TYPES.items()}, index=keys)
+
+	return pd.concat(partials).groupby(level=ROUTE_KEYS, sort=False).agg(PARTIALS)
+
+# Month (year * 100 + month) of every row of the raw flights
+def read_months(path, chunk_rows):
+	months = [np.array([], dtype=np.int64)]
+	for chunk in pd.read_csv(path, usecols=['year', 'month'], chunksize=chunk_rows):
+		months.append(chunk['year'].values.astype(np.int64) * 100 + chunk['month'].values)
+	return np.concatenate(months)
+
+# Chunks of the raw flights of the rows where read is True, the other rows
+# are skipped by the parser without being parsed. Rows of the latest month
+# come in chunks of their own.
+def read_chunks(path, chunk_rows, read, latest):
+	# Line 0 is the header, line i the row i - 1. A callable rather than a
+	# set of line numbers, which would take memory for every skipped row.
+	def skip(line):
+		return line > 0 and not read[line - 1]
+
+	for chunk in pd.read_csv(path, usecols=RAW_COLUMNS, skiprows=skip, chunksize=chunk_rows):
+		in_latest = (chunk['year'].values * 100 + chunk['month'].values) == latest
+		for part in (chunk[~in_latest], chunk[in_latest]):
+			if len(part):
+				yield part
+
+# Longitude and latitude of the airports, indexed by code
+def read_airports(path):
+	airports = pd.read_csv(path, usecols=['IATA', 'Longitude', 'Latitude'])
+	return airports.drop_duplicates('IATA').set_index('IATA')
+
+# Flat route columns (as written to the artifact) from merged partials
+def route_columns(partials, airports):
+	routes = partials.reset_index()
+
+	# Coordinates of both ends of every route by position in the airports
+	origin_rows = airports.index.get_indexer(routes['origin'])
+	dest_rows = airports.index.get_indexer(routes['dest'])
+	found = (origin_rows >= 0) & (dest_rows >= 0)
+	if not found.all():
+		logger.info('Leaving out %d routes to airports without coordinates',
+					int((~found).sum()))
+
+	routes = routes[found]
+	origin_rows, dest_rows = origin_rows[found], dest_rows[found]
+
+	longitude = airports['Longitude'].values
+	latitude = airports['Latitude'].values
+
+	with np.errstate(invalid='ignore', divide='ignore'):
+		columns = {'origin': routes['origin'].values.astype(str),
+				   'dest': routes['dest'].values.astype(str),
+				   'carrier': routes['carrier'].values.astype(str),
+				   'mean_delay': routes['delay_sum'].values / routes['count'].values,
+				   'distance': routes['distance_sum'].values / routes['distance_count'].values,
+				   'origin_x_loc': longitude[origin_rows],
+				   'origin_y_loc': latitude[origin_rows],
+				   'dest_x_loc': longitude[dest_rows],
+				   'dest_y_loc': latitude[dest_rows]}
+
+	for name, dtype in PARTIAL_TYPES.items():
+		columns[name] = routes[name].values.astype(dtype)
+
+	return columns
+
+# Partials and months of the built months of an existing artifact (None
+# if there is none, or it is from before the built partials were kept
+# apart from the routes)
+def read_artifact(path):
+	empty = None, np.array([], dtype=np.int64)
+	if not os.path.exists(path):
+		return empty
+
+	with np.load(path) as artifact:
+		names = ROUTE_KEYS + list(PARTIALS)
+		if not all('built_' + name in artifact for name in names):
+			return empty
+
+		partials = pd.DataFrame({name: artifact['built_' + name] for name in names})
+		months = artifact['months']
+
+	return partials.set_index(ROUTE_KEYS), months
+
+# Partial columns (route keys included) stored as built_<name>
+def built_columns(partials):
+	partials = partials.reset_index()
+	columns = {'built_' + name: partials[name].values.astype(str) for name in ROUTE_KEYS}
+	for name, dtype in PARTIAL_TYPES.items():
+		columns['built_' + name] = partials[name].values.astype(dtype)
+	return columns
+
+def build(flights_path, airports_path, output_path, chunk_rows = 200000,
+		  jobs = None, full = False):
+	start = time.time()
+
+	previous, built_months = (None, np.array([], dtype=np.int64)) if full else read_artifact(output_path)
+
+	row_months = read_months(flights_path, chunk_rows)
+	read = ~np.isin(row_months, built_months)
+	if not read.any():
+		logger.info('%s is up to date (%d months)', output_path, len(built_months))
+		return False
+
+	latest = int(row_months.max())
+	chunks = read_chunks(flights_path, chunk_rows, read, latest)
+	jobs = jobs or multiprocessing.cpu_count()
+
+	if jobs > 1:
+		with multiprocessing.Pool(jobs) as pool:
+			results = list(pool.imap_unordered(aggregate, chunks))
+	else:
+		results = [aggregate(chunk) for chunk in chunks]
+
+	# Only the months before the latest one are built for good
+	new_months = np.unique(np.concatenate([months for _, months in results] +
+										  [np.array([], dtype=np.int64)]))
+	new_months = new_months[new_months != latest]
+
+	built = merge([partial for partial, months in results if latest not in months] +
+				  ([previous] if previous is not None else []))
+	partials = merge([built] + [partial for partial, months in results if latest in months])
+
+	# Routes dropped for missing coordinates are left out of the routes
+	# only, they would be dropped again
+	columns = route_columns(partials, read_airports(airports_path))
+	columns.update(built_columns(built))
+	columns['months'] = np.union1d(built_months, new_months).astype(np.int64)
+
+	# Write next to the output and move it into place so the app never
+	# reads a half written file
+	temporary = output_path + '.tmp.npz'
+	np.savez(temporary, **columns)
+	os.replace(temporary, output_path)
+
+	logger.info('Built %d routes from %d new months in %.2fs with %d jobs into %s',
+				len(columns['carrier']), len(new_months), time.time() - start,
+				jobs, output_path)
+	return True
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Build the route table of the flight map')
+	parser.add_argument('--flights', default = os.path.join(DATA_DIR, 'flights.csv'),
+						help = 'raw flights csv')
+	parser.add_argument('--airports', default = os.path.join(DATA_DIR, 'airports.csv'),
+						help = 'csv of airport codes (IATA), Longitude and Latitude')
+	parser.add_argument('--output', default = os.path.join(DATA_DIR, 'flights_map.npz'))
+	parser.add_argument('--chunk-rows', type = int, default = 200000)
+	parser.add_argument('--jobs', type = int, default = None,
+						help = 'worker processes (default: one per core)')
+	parser.add_argument('--full', action = 'store_true',
+						help = 'rebuild every month instead of only the new ones')
+	args = parser.parse_args()
+
+	logging.basicConfig(level = logging.INFO, format = '%(message)s')
+	build(args.flights, args.airports, args.output, args.chunk_rows, args.jobs, args.full)
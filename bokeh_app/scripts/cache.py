@@ -0,0 +1,143 @@
+# Bounded least recently used cache for computed results
+#
+# Entries are evicted, oldest use first, once their total size goes over
+# max_bytes. Hits, misses and evictions are counted so they can be logged.
+#
+# dataset_cache holds the tabs' datasets by widget state for every session
+# of the process, so sessions asking for a state another session (or the
+# prewarming in server_lifecycle.py) already computed only look it up.
+# Tabs drawing the flights include the version of the snapshot they read
+# in the state, so datasets of older rows are never found once new rows
+# are folded in and age out of the cache.
+
+import logging
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from scripts import metrics
+from scripts.config import DATASET_CACHE_MB
+
+logger = logging.getLogger(__name__)
+
+# Approximate memory used by a cached value
+def sizeof(value):
+	if isinstance(value, np.ndarray):
+		return value.nbytes + 96
+	elif isinstance(value, dict):
+		return sys.getsizeof(value) + sum(sizeof(k) + sizeof(v) for k, v in value.items())
+	elif isinstance(value, (list, tuple)):
+		return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+	return sys.getsizeof(value)
+
+class LRUCache(object):
+
+	def __init__(self, max_bytes, name = 'cache'):
+		self.max_bytes = int(max_bytes)
+		self.name = name
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		# key -> (value, size), most recently used last
+		self._items = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._items)
+
+	def __contains__(self, key):
+		return key in self._items
+
+	def get(self, key, default = None):
+		with self._lock:
+			if key in self._items:
+				self._items.move_to_end(key)
+				self.hits += 1
+				return self._items[key][0]
+
+			self.misses += 1
+			return default
+
+	def put(self, key, value):
+		size = sizeof(value)
+
+		with self._lock:
+			if key in self._items:
+				self.nbytes -= self._items.pop(key)[1]
+
+			# Values bigger than the whole cache are not kept
+			if size > self.max_bytes:
+				return value
+
+			self._items[key] = (value, size)
+			self.nbytes += size
+
+			while self.nbytes > self.max_bytes:
+				_, (_, evicted) = self._items.popitem(last = False)
+				self.nbytes -= evicted
+				self.evictions += 1
+
+		return value
+
+	# Cached value for key, calling compute() to fill it on a miss
+	def get_or_compute(self, key, compute):
+		missing = object()
+		value = self.get(key, missing)
+		if value is missing:
+			value = self.put(key, compute())
+		return value
+
+	def clear(self):
+		with self._lock:
+			self._items.clear()
+			self.nbytes = 0
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {'name': self.name, 'entries': len(self._items),
+				'bytes': self.nbytes, 'max_bytes': self.max_bytes,
+				'hits': self.hits, 'misses': self.misses,
+				'evictions': self.evictions,
+				'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
+
+	def log_stats(self, level = logging.DEBUG):
+		logger.log(level, '%(name)s: %(entries)d entries, %(bytes)d / %(max_bytes)d bytes, '
+				   '%(hits)d hits, %(misses)d misses, %(evictions)d evictions', self.stats())
+
+# Key of a tab's dataset for the state of its widgets. Numbers become
+# rounded floats and sequences tuples, so a slider giving 5 or 5.0 finds
+# the same entry.
+def state_key(tab, **state):
+	return (tab,) + tuple((name, normalize(value)) for name, value in sorted(state.items()))
+
+def normalize(value):
+	if isinstance(value, (list, tuple, np.ndarray)):
+		return tuple(normalize(item) for item in value)
+	if value is None or isinstance(value, (str, bool, np.bool_)):
+		return value
+	if isinstance(value, (int, float, np.number)):
+		return round(float(value), 6)
+	return value
+
+# Columns of a cached dataset for a new source. Sources patch their
+# columns in place, so each one gets its own copy.
+def copy_columns(data):
+	return {name: values.copy() if isinstance(values, np.ndarray) else list(values)
+			for name, values in data.items()}
+
+dataset_cache = LRUCache(DATASET_CACHE_MB * 2 ** 20, name = 'tab datasets')
+metrics.watch_cache(dataset_cache)
+
+# Dataset of a tab for a widget state, computing it on a miss
+def cached_dataset(compute, tab, **state):
+	return dataset_cache.get_or_compute(state_key(tab, **state), compute)
+
+# Key and cached dataset (None on a miss) of a tab for a widget state, for
+# datasets computed elsewhere and stored with dataset_cache.put(key, ...)
+def lookup_dataset(tab, **state):
+	key = state_key(tab, **state)
+	return key, dataset_cache.get(key)
@@ -0,0 +1,54 @@
+# Threads for the tabs' dataset computations
+#
+# Tab callbacks run on the server loop, so a density fit for a big
+# carrier used to hold up every session of the process. Tabs hand the
+# work to fan_out instead, one task per carrier: the tasks run in
+# parallel on a pool of threads while the loop keeps serving sessions,
+# and CallbackScheduler.offload applies the results to the document on
+# the loop. numpy and scipy release the GIL for the array work, and
+# threads share the mapped index, the cube and the caches without copying
+# or pickling anything, which a process pool would need.
+#
+# Tasks only read the shared data, from the snapshot their update started
+# with (see scripts/registry.py), and must not touch bokeh models.
+
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.config import COMPUTE_THREADS
+
+_executor = (ThreadPoolExecutor(COMPUTE_THREADS, thread_name_prefix = 'compute')
+			 if COMPUTE_THREADS > 0 else None)
+
+# Run tasks (functions without arguments) in parallel, then call
+# done(results, error) from the thread finishing last, with the results
+# in the order of the tasks and the first exception raised (or None).
+# Tasks that have not started when cancelled() returns True are skipped.
+def fan_out(tasks, done, cancelled = lambda: False):
+	results = [None] * len(tasks)
+	errors = []
+	remaining = [len(tasks)]
+	lock = threading.Lock()
+
+	def run(i, task):
+		try:
+			if not cancelled():
+				results[i] = task()
+		except Exception as error:
+			errors.append(error)
+
+		with lock:
+			remaining[0] -= 1
+			last = remaining[0] == 0
+		if last:
+			done(results, errors[0] if errors else None)
+
+	if not tasks:
+		done(results, None)
+	elif _executor is None:
+		for i, task in enumerate(tasks):
+			run(i, task)
+	else:
+		for i, task in enumerate(tasks):
+			_executor.submit(run, i, task)
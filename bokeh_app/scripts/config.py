@@ -0,0 +1,40 @@
+# Settings for the app, each one can be overridden with an environment variable
+
+import os
+
+# Engine used for the density plot by default: 'binned' or 'exact'
+DENSITY_ENGINE = os.environ.get('FLIGHTS_DENSITY_ENGINE', 'binned')
+
+# Memory ceiling of the cache of density curves (MB, shared by all sessions)
+DENSITY_CACHE_MB = float(os.environ.get('FLIGHTS_DENSITY_CACHE_MB', 64))
+
+# Memory ceiling of the cache of tab datasets by widget state (MB, shared
+# by all sessions)
+DATASET_CACHE_MB = float(os.environ.get('FLIGHTS_DATASET_CACHE_MB', 64))
+
+# Widget changes are run once the widgets have been quiet for this long,
+# and never later than CALLBACK_MAX_WAIT_MS after the first change (ms)
+CALLBACK_DELAY_MS = int(os.environ.get('FLIGHTS_CALLBACK_DELAY_MS', 50))
+CALLBACK_MAX_WAIT_MS = int(os.environ.get('FLIGHTS_CALLBACK_MAX_WAIT_MS', 250))
+
+# Threads computing the tabs' datasets off the server loop, one carrier
+# per task (0 computes them on the loop)
+COMPUTE_THREADS = int(os.environ.get('FLIGHTS_COMPUTE_THREADS', min(os.cpu_count() or 1, 8)))
+
+# Route Details draws one point per flight up to this many flights in view,
+# above it each carrier is drawn as a binned strip with this many bins
+ROUTE_LOD_ROWS = int(os.environ.get('FLIGHTS_ROUTE_LOD_ROWS', 5000))
+ROUTE_LOD_BINS = int(os.environ.get('FLIGHTS_ROUTE_LOD_BINS', 120))
+
+# Append-only flights file or drop directory of csv files to take new rows
+# from while the server runs (empty to turn ingestion off), and how often
+# to look for new rows (ms)
+INGEST_PATH = os.environ.get('FLIGHTS_INGEST_PATH', '')
+INGEST_INTERVAL_MS = int(os.environ.get('FLIGHTS_INGEST_INTERVAL_MS', 1000))
+
+# New rows are kept in memory on top of the mapped flights and index, and
+# compacted into new mapped files once there are this many of them
+COMPACT_ROWS = int(os.environ.get('FLIGHTS_COMPACT_ROWS', 100000))
+
+# Directory of the columnar cache of flights.csv (default: data/cache/flights)
+CACHE_DIR = os.environ.get('FLIGHTS_CACHE_DIR', '')
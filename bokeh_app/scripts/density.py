@@ -2,53 +2,69 @@
 import pandas as pd
 import numpy as np
 
-from scipy.stats import gaussian_kde
+from functools import partial
 
 from bokeh.plotting import figure
 from bokeh.models import (CategoricalColorMapper, HoverTool, 
 						  ColumnDataSource, Panel, 
 						  FuncTickFormatter, SingleIntervalTicker, LinearAxis)
 from bokeh.models.widgets import (CheckboxGroup, Slider, RangeSlider, 
-								  Tabs, CheckboxButtonGroup, 
+								  Tabs, CheckboxButtonGroup, RadioButtonGroup,
 								  TableColumn, DataTable, Select)
 from bokeh.layouts import column, row, WidgetBox
 from bokeh.palettes import Category20_16
 
-def density_tab(flights):
+from scripts import metrics
+from scripts.config import DENSITY_ENGINE
+from scripts.cache import cached_dataset, copy_columns, dataset_cache, lookup_dataset
+from scripts.kde import carrier_density, curve_cache
+from scripts.scheduler import CallbackScheduler
+from scripts.updates import update_source
+from scripts.ingest import listen
+
+# Density plot tab, from the latest snapshot of the shared datasets when
+# each update runs
+def density_tab(datasets):
 	
 	# Dataset for density plot based on carriers, range of delays,
-	# and bandwidth for density estimation
-	def make_dataset(carrier_list, range_start, range_end, bandwidth):
-
+	# bandwidth and engine for density estimation
+	@metrics.timed(metrics.dataset_seconds, tab = 'density')
+	def make_dataset(carrier_list, range_start, range_end, bandwidth,
+					 engine = DENSITY_ENGINE):
+
+		# Evenly space x values
+		x = np.linspace(range_start, range_end, 100)
+		snapshot = datasets.snapshot
+
+		# Evaluate pdf at every value of x, shared with the other sessions
+		# showing the same state
+		data = cached_dataset(
+			lambda: density_columns(carrier_list, x, [
+				carrier_density(engine, snapshot, carrier, range_start, range_end, bandwidth, x)
+				for carrier in carrier_list]),
+			'density', carriers = carrier_list, range_start = range_start,
+			range_end = range_end, bandwidth = bandwidth, engine = engine,
+			version = snapshot.version)
+
+		return ColumnDataSource(data = copy_columns(data))
+
+	# Multi line columns from the density of each carrier at the points x
+	def density_columns(carrier_list, x, curves):
 		xs = []
 		ys = []
 		colors = []
 		labels = []
 
-		for i, carrier in enumerate(carrier_list):
-			subset = flights[flights['name'] == carrier]
-			subset = subset[subset['arr_delay'].between(range_start, 
-														range_end)]
-
-			kde = gaussian_kde(subset['arr_delay'], bw_method=bandwidth)
-			
-			# Evenly space x values
-			x = np.linspace(range_start, range_end, 100)
-			# Evaluate pdf at every value of x
-			y = kde.pdf(x)
-
-			# Append the values to plot
-			xs.append(list(x))
-			ys.append(list(y))
+		for carrier, y in zip(carrier_list, curves):
+			# Append the values to plot (float32 arrays are sent as binary)
+			xs.append(x.astype(np.float32))
+			ys.append(y.astype(np.float32))
 
 			# Append the colors and label
-			colors.append(airline_colors[i])
+			colors.append(color_dict[carrier])
 			labels.append(carrier)
 
-		new_src = ColumnDataSource(data={'x': xs, 'y': ys, 
-								   'color': colors, 'label': labels})
-
-		return new_src
+		return {'x': xs, 'y': ys, 'color': colors, 'label': labels}
 
 	def make_plot(src):
 		p = figure(plot_width = 700, plot_height = 700,
@@ -62,8 +78,8 @@ def density_tab(flights):
 
 		# Hover tool with next line policy
 		hover = HoverTool(tooltips=[('Carrier', '@label'), 
-									('Delay', '$x'),
-									('Density', '$y')],
+									('Delay', '$x{0.0}'),
+									('Density', '$y{0.00000}')],
 						  line_policy = 'next')
 
 		# Add the hover tool and styling
@@ -85,13 +101,36 @@ def density_tab(flights):
 		else:
 			bandwidth = bandwidth_select.value
 			
-		
-		new_src = make_dataset(carriers_to_plot,
-									range_start = range_select.value[0],
-									range_end = range_select.value[1],
-									bandwidth = bandwidth)
-		
-		src.data.update(new_src.data)
+
+		range_start, range_end = range_select.value
+		engine = engines[engine_select.active]
+		snapshot = datasets.snapshot
+
+		key, data = lookup_dataset('density', carriers = carriers_to_plot,
+								   range_start = range_start, range_end = range_end,
+								   bandwidth = bandwidth, engine = engine,
+								   version = snapshot.version)
+
+		# Only send the rows and columns that changed
+		def show(data):
+			update_source(src, copy_columns(data), key = 'label')
+
+			# Hits and misses of the density curve cache
+			curve_cache.log_stats()
+
+		if data is not None:
+			show(data)
+			return
+
+		# Fit each carrier on the compute threads, all from this snapshot
+		x = np.linspace(range_start, range_end, 100)
+
+		def apply(curves):
+			show(dataset_cache.put(key, density_columns(carriers_to_plot, x, curves)))
+
+		scheduler.offload([partial(carrier_density, engine, snapshot, carrier,
+								   range_start, range_end, bandwidth, x)
+						   for carrier in carriers_to_plot], apply)
 		
 	def style(p):
 		# Title 
@@ -112,20 +151,27 @@ def density_tab(flights):
 		return p
 	
 	# Carriers and colors
-	available_carriers = list(set(flights['name']))
-	available_carriers.sort()
+	available_carriers = list(datasets.index.carriers)
 
 	airline_colors = Category20_16
 	airline_colors.sort()
 
+	# Dictionary mapping carriers to colors, fixed so that changing the
+	# selection only sends the rows of the carriers added or removed
+	color_dict = {carrier: airline_colors[i % len(airline_colors)]
+				  for i, carrier in enumerate(available_carriers)}
+
+	# Bursts of widget changes run a single update
+	scheduler = CallbackScheduler(update, tab = 'density')
+
 	# Carriers to plot
 	carrier_selection = CheckboxGroup(labels=available_carriers, 
 									   active = [0, 1])
-	carrier_selection.on_change('active', update)
+	scheduler.watch(carrier_selection, 'active', name = 'carriers')
 	
 	range_select = RangeSlider(start = -60, end = 180, value = (-60, 120),
 							   step = 5, title = 'Range of Delays (min)')
-	range_select.on_change('value', update)
+	scheduler.watch(range_select, 'value', throttled = True)
 	
 	# Initial carriers and data source
 	initial_carriers = [carrier_selection.labels[i] for 
@@ -135,18 +181,28 @@ def density_tab(flights):
 	bandwidth_select = Slider(start = 0.1, end = 5, 
 							  step = 0.1, value = 0.5,
 							  title = 'Bandwidth for Density Plot')
-	bandwidth_select.on_change('value', update)
+	scheduler.watch(bandwidth_select, 'value', throttled = True)
 	
 	# Whether to set the bandwidth or have it done automatically
 	bandwidth_choose = CheckboxButtonGroup(
 		labels=['Choose Bandwidth (Else Auto)'], active = [])
-	bandwidth_choose.on_change('active', update)
+	scheduler.watch(bandwidth_choose, 'active', name = 'bandwidth choice')
+
+	# Binned (fast) or exact density estimation, default from the config
+	engines = ['binned', 'exact']
+	engine_select = RadioButtonGroup(labels = ['Binned (FFT)', 'Exact'],
+									 active = engines.index(DENSITY_ENGINE))
+	scheduler.watch(engine_select, 'active', name = 'engine')
+
+	# Redraw with new flights as they come in
+	listen(lambda ready: scheduler.run('data', None, None, ready = ready))
 
 	# Make the density data source
 	src = make_dataset(initial_carriers, 
 						range_start = range_select.value[0],
 						range_end = range_select.value[1],
-						bandwidth = bandwidth_select.value) 
+						bandwidth = bandwidth_select.value,
+						engine = engines[engine_select.active]) 
 	
 	# Make the density plot
 	p = make_plot(src)
@@ -156,7 +212,7 @@ def density_tab(flights):
 	
 	# Put controls in a single element
 	controls = WidgetBox(carrier_selection, range_select, 
-						 bandwidth_select, bandwidth_choose)
+						 bandwidth_select, bandwidth_choose, engine_select)
 	
 	# Create a row layout
 	layout = row(controls, p)
@@ -12,98 +12,40 @@ from bokeh.models.widgets import (CheckboxGroup, Slider, RangeSlider,
 from bokeh.layouts import column, row, WidgetBox
 from bokeh.palettes import Category20_16
 
-def map_tab(map_data, states):
+from scripts import metrics
+from scripts.cache import cached_dataset, copy_columns
+from scripts.geometry import state_level, tolerance_for
+from scripts.scheduler import CallbackScheduler
+from scripts.updates import update_source
+
+def map_tab(routes, states):
+	# states: outlines of the contiguous states from scripts/geometry.py,
+	# drawn simplified to the current zoom
 
 	# Function to make a dataset for the map based on a list of carriers
+	@metrics.timed(metrics.dataset_seconds, tab = 'map')
 	def make_dataset(carrier_list):
-		
-		# Subset to the carriers in the specified list
-		subset = map_data[map_data['carrier']['Unnamed: 3_level_1'].isin(
-														   carrier_list)]
 
-		
-		# Dictionary mapping carriers to colors
-		color_dict = {carrier: color for carrier, color in zip(
-			available_carriers, airline_colors)}
-		
-		# Lists of data for plotting
-		flight_x = []
-		flight_y = []
-		colors = []
-		carriers = []
-		counts = []
-		mean_delays = []
-		min_delays = []
-		max_delays = []
-		dest_loc = []
-		origin_x_loc = []
-		origin_y_loc = []
-		dest_x_loc = []
-		dest_y_loc = []
-		origins = []
-		dests = []
-		distances = []
-
-		# Iterate through each carrier
-		for carrier in carrier_list:
-
-			# Subset to the carrier
-			sub_carrier = subset[subset['carrier']['Unnamed: 3_level_1'] == carrier]
-
-			# Iterate through each route (origin to destination) for the carrier
-			for _, row in sub_carrier.iterrows():
-
-				colors.append(color_dict[carrier])
-				carriers.append(carrier)
-				origins.append(row['origin']['Unnamed: 1_level_1'])
-				dests.append(row['dest']['Unnamed: 2_level_1'])
-
-				# Origin x (longitude) and y (latitude) location
-				origin_x_loc.append(row['start_long']['Unnamed: 20_level_1'])
-				origin_y_loc.append(row['start_lati']['Unnamed: 21_level_1'])
-
-				# Destination x (longitude) and y latitude (location)
-				dest_x_loc.append(row['end_long']['Unnamed: 22_level_1'])
-				dest_y_loc.append(row['end_lati']['Unnamed: 23_level_1'])
-
-				# Flight x (longitude) locations
-				flight_x.append([row['start_long']['Unnamed: 20_level_1'], 
-								 row['end_long']['Unnamed: 22_level_1']])
-
-				# Flight y (latitude) locations
-				flight_y.append([row['start_lati']['Unnamed: 21_level_1'], 
-								 row['end_lati']['Unnamed: 23_level_1']])
-
-
-				# Stats about the particular route
-				counts.append(row['arr_delay']['count'])
-				mean_delays.append(row['arr_delay']['mean'])
-				min_delays.append(row['arr_delay']['min'])
-				max_delays.append(row['arr_delay']['max'])
-				distances.append(row['distance']['mean'])
-
-
-		# Create a column data source from the lists of lists
-		new_src = ColumnDataSource(data = {'carrier': carriers, 'flight_x': flight_x, 'flight_y': flight_y, 
-											   'origin_x_loc': origin_x_loc, 'origin_y_loc': origin_y_loc,
-											   'dest_x_loc': dest_x_loc, 'dest_y_loc': dest_y_loc,
-											   'color': colors, 'count': counts, 'mean_delay': mean_delays,
-											   'origin': origins, 'dest': dests, 'distance': distances,
-											   'min_delay': min_delays, 'max_delay': max_delays})
+		# Blocks of precomputed routes for the carriers in the list, shared
+		# with the other sessions showing the same carriers
+		data = cached_dataset(lambda: routes.select(carrier_list, color_dict),
+							  'map', carriers = carrier_list)
+		new_src = ColumnDataSource(data = copy_columns(data))
 
 		return new_src
 
-	def make_plot(src, xs, ys):
+	def make_plot(src, state_src):
 		
 		# Create the plot with no axes or grid
-		p = figure(plot_width = 1100, plot_height = 700, title = 'Map of 2013 Flight Delays Departing NYC')
+		p = figure(plot_width = width, plot_height = height, title = 'Map of 2013 Flight Delays Departing NYC')
 		p.xaxis.visible = False
 		p.yaxis.visible = False
 		p.grid.visible = False
 
 		# States are drawn as patches
-		patches_glyph = p.patches(xs, ys, fill_alpha=0.2, fill_color = 'lightgray', 
-								  line_color="#884444", line_width=2, line_alpha=0.8)
+		patches_glyph = p.patches('xs', 'ys', fill_alpha=0.2, fill_color = 'lightgray', 
+								  line_color="#884444", line_width=2, line_alpha=0.8,
+								  source = state_src)
 
 		# Airline flights are drawn as lines
 		lines_glyph = p.multi_line('flight_x', 'flight_y', color = 'color', line_width = 2, 
@@ -136,7 +78,7 @@ def map_tab(map_data, states):
 		# Hover tooltip for origin and destination, assign only the line renderer
 		hover_circle = HoverTool(tooltips=[('Origin', '@origin'),
 										   ('Dest', '@dest'),
-										   ('Distance (miles)', '@distance')],
+										   ('Distance (miles)', '@distance{0}')],
 								renderers = [circles_glyph])
 
 		# Position the location so it does not overlap plot
@@ -176,26 +118,48 @@ def map_tab(map_data, states):
 		carrier_list = [carrier_selection.labels[i] for i in carrier_selection.active]
 		new_src = make_dataset(carrier_list)
 
-		src.data.update(new_src.data)
+		# Only send the rows and columns that changed
+		update_source(src, new_src.data, key = 'carrier')
+
+	# Swap in finer or coarser outlines when the zoom level changes
+	def zoom(attr, old, new):
+		x_range, y_range = p.x_range, p.y_range
+		if None in (x_range.start, x_range.end, y_range.start, y_range.end):
+			return
+
+		tolerance = tolerance_for(abs(x_range.end - x_range.start),
+								  abs(y_range.end - y_range.start), width, height)
+		if tolerance != shown_tolerance[0]:
+			shown_tolerance[0] = tolerance
+			state_src.data = state_level(tolerance)
 			
 			
-	available_carriers = list(set(map_data['carrier']['Unnamed: 3_level_1']))
-	available_carriers.sort()
+	available_carriers = list(routes.carriers)
 
 	airline_colors = Category20_16
 	airline_colors.sort()
 
-	# Remove Alaska and Hawaii from states
-	if 'HI' in states: del states['HI']
-	if 'AK' in states: del states['AK']
+	# Dictionary mapping carriers to colors
+	color_dict = {carrier: airline_colors[i % len(airline_colors)]
+				  for i, carrier in enumerate(available_carriers)}
+
+	# Size of the map in pixels
+	width, height = 1100, 700
 
-	# Put longitudes and latitudes in lists
-	xs = [states[state]['lons'] for state in states]
-	ys = [states[state]['lats'] for state in states]
+	# Longitudes and latitudes of the states (Alaska and Hawaii left out),
+	# simplified for the whole country to start with
+	all_x = np.concatenate(states['xs'])
+	all_y = np.concatenate(states['ys'])
+	shown_tolerance = [tolerance_for(np.nanmax(all_x) - np.nanmin(all_x),
+									 np.nanmax(all_y) - np.nanmin(all_y), width, height)]
+	state_src = ColumnDataSource(data = state_level(shown_tolerance[0]))
+
+	# Bursts of widget changes run a single update
+	scheduler = CallbackScheduler(update, tab = 'map')
 
 	# CheckboxGroup to select carriers for plotting    
 	carrier_selection = CheckboxGroup(labels=available_carriers, active = [0, 1])
-	carrier_selection.on_change('active', update)
+	scheduler.watch(carrier_selection, 'active', name = 'carriers')
 
 	# Initial carriers to plot
 	initial_carriers = [carrier_selection.labels[i] for i in carrier_selection.active]
@@ -203,7 +167,13 @@ def map_tab(map_data, states):
 	# Initial source and plot
 	src = make_dataset(initial_carriers)
 
-	p = make_plot(src, xs, ys)
+	p = make_plot(src, state_src)
+
+	# Zoom changes are coalesced like widget changes
+	zoom_scheduler = CallbackScheduler(zoom, tab = 'map')
+	for plot_range in (p.x_range, p.y_range):
+		zoom_scheduler.watch(plot_range, 'start', name = 'zoom')
+		zoom_scheduler.watch(plot_range, 'end', name = 'zoom')
 
 	# Layout setup
 	layout = row(carrier_selection, p)
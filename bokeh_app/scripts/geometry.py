@@ -0,0 +1,139 @@
+# Outlines of the contiguous US states drawn under the flight map
+#
+# The outlines come from bokeh's us_states sample data, which takes about
+# 80 ms to import and parse, and the map used to drop Alaska and Hawaii by
+# deleting them from that shared dict. Instead the outlines of the other
+# states are stored once in data/us_states.npz (flat longitude and
+# latitude arrays with the offset of every state) and read from there,
+# once per process. The sample data is only imported to build the file.
+#
+# The outlines are also simplified (Douglas-Peucker) at a few tolerances,
+# once per process. The map draws the coarsest level that is still finer
+# than a pixel at its current zoom, so the whole country is sent with a
+# fraction of the points and detail is only swapped in when zoomed in.
+#
+# Rebuild the file from the bokeh_app directory:
+#     python -m scripts.geometry
+
+import os
+import threading
+
+import numpy as np
+
+from scripts.registry import DATA_DIR
+
+STATES_PATH = os.path.join(DATA_DIR, 'us_states.npz')
+
+# States left off the map
+EXCLUDED_STATES = ('AK', 'HI')
+
+# Simplification tolerances (degrees), coarsest first, 0 for the full outlines
+TOLERANCES = (0.05, 0.02, 0.005, 0.001, 0)
+
+_lock = threading.Lock()
+_states = None
+_levels = {}
+
+# Write the outlines of the contiguous states from bokeh's sample data
+def build_states(path = STATES_PATH):
+	from bokeh.sampledata.us_states import data as states
+
+	codes = sorted(code for code in states if code not in EXCLUDED_STATES)
+	lons = [np.asarray(states[code]['lons'], dtype=np.float64) for code in codes]
+	lats = [np.asarray(states[code]['lats'], dtype=np.float64) for code in codes]
+
+	np.savez(path, codes = np.array(codes),
+			 lons = np.concatenate(lons), lats = np.concatenate(lats),
+			 offsets = np.cumsum([0] + [len(outline) for outline in lons]))
+
+# {'state': codes, 'xs': longitudes, 'ys': latitudes} with one array per
+# state, loaded on first use and shared (read-only) by every session
+def contiguous_states(path = STATES_PATH):
+	global _states
+
+	with _lock:
+		if _states is None:
+			if not os.path.exists(path):
+				build_states(path)
+
+			with np.load(path) as artifact:
+				offsets = artifact['offsets']
+				bounds = list(zip(offsets[:-1], offsets[1:]))
+				_states = {'state': list(artifact['codes']),
+						   'xs': [artifact['lons'][start:stop] for start, stop in bounds],
+						   'ys': [artifact['lats'][start:stop] for start, stop in bounds]}
+
+	return _states
+
+# Which points of a line to keep so no dropped point is further than
+# tolerance from the simplified line (Douglas-Peucker)
+def douglas_peucker(x, y, tolerance):
+	keep = np.zeros(len(x), dtype=bool)
+	keep[[0, -1]] = True
+
+	stack = [(0, len(x) - 1)]
+	while stack:
+		first, last = stack.pop()
+		if last - first < 2:
+			continue
+
+		# Distance of the points between first and last to their segment
+		# (to the point itself when the segment closes a ring)
+		dx, dy = x[last] - x[first], y[last] - y[first]
+		px, py = x[first + 1:last] - x[first], y[first + 1:last] - y[first]
+		length = np.hypot(dx, dy)
+		if length > 0:
+			distances = np.abs(px * dy - py * dx) / length
+		else:
+			distances = np.hypot(px, py)
+
+		farthest = int(np.argmax(distances))
+		if distances[farthest] > tolerance:
+			split = first + 1 + farthest
+			keep[split] = True
+			stack.append((first, split))
+			stack.append((split, last))
+
+	return keep
+
+# Simplified outline of one state, whose parts (islands) are separated by NaNs
+def simplify(x, y, tolerance):
+	if tolerance == 0:
+		return x, y
+
+	breaks = np.flatnonzero(np.isnan(x))
+	keep = np.zeros(len(x), dtype=bool)
+	keep[breaks] = True
+	for start, stop in zip(np.r_[0, breaks + 1], np.r_[breaks, len(x)]):
+		if stop - start > 2:
+			keep[start:stop] = douglas_peucker(x[start:stop], y[start:stop], tolerance)
+		else:
+			keep[start:stop] = True
+
+	return x[keep], y[keep]
+
+# States outlines simplified with the tolerance, computed once per process
+def state_level(tolerance):
+	states = contiguous_states()
+
+	with _lock:
+		if tolerance not in _levels:
+			outlines = [simplify(x, y, tolerance) for x, y in zip(states['xs'], states['ys'])]
+			_levels[tolerance] = {'state': states['state'],
+								  'xs': [x for x, _ in outlines],
+								  'ys': [y for _, y in outlines]}
+
+	return _levels[tolerance]
+
+# Coarsest tolerance under half a pixel for a view spanning x_span and
+# y_span degrees on a plot of width by height pixels
+def tolerance_for(x_span, y_span, width, height):
+	pixel = min(x_span / float(width), y_span / float(height))
+	for tolerance in TOLERANCES:
+		if tolerance <= pixel / 2:
+			return tolerance
+	return 0
+
+if __name__ == '__main__':
+	build_states()
+	print('Wrote %s' % STATES_PATH)
@@ -1,7 +1,8 @@
-# pandas and numpy for data manipulation
-import pandas as pd
+# numpy for data manipulation
 import numpy as np
 
+from functools import partial
+
 from bokeh.plotting import figure
 from bokeh.models import (CategoricalColorMapper, HoverTool, 
 						  ColumnDataSource, Panel, 
@@ -12,53 +13,37 @@ from bokeh.models.widgets import (CheckboxGroup, Slider, RangeSlider,
 from bokeh.layouts import column, row, WidgetBox
 from bokeh.palettes import Category20_16
 
-# Make plot with histogram and return tab
-def histogram_tab(flights):
+from scripts import metrics
+from scripts.binning import (bin_edges, carrier_histograms, carrier_proportions,
+							 histogram_columns)
+from scripts.cache import cached_dataset, copy_columns, dataset_cache, lookup_dataset
+from scripts.scheduler import CallbackScheduler
+from scripts.updates import update_source
+from scripts.ingest import listen
+
+# Make plot with histogram and return tab, from the latest snapshot of the
+# shared datasets when each update runs
+def histogram_tab(datasets):
 
 	# Function to make a dataset for histogram based on a list of carriers
 	# a minimum delay, maximum delay, and histogram bin width
+	@metrics.timed(metrics.dataset_seconds, tab = 'histogram')
 	def make_dataset(carrier_list, range_start = -60, range_end = 120, bin_width = 5):
 
-		# Dataframe to hold information
-		by_carrier = pd.DataFrame(columns=['proportion', 'left', 'right', 
-										   'f_proportion', 'f_interval',
-										   'name', 'color'])
-		
-		range_extent = range_end - range_start
-
-		# Iterate through all the carriers
-		for i, carrier_name in enumerate(carrier_list):
-
-			# Subset to the carrier
-			subset = flights[flights['name'] == carrier_name]
-
-			# Create a histogram with 5 minute bins
-			arr_hist, edges = np.histogram(subset['arr_delay'], 
-										   bins = int(range_extent / bin_width), 
-										   range = [range_start, range_end])
-
-			# Divide the counts by the total to get a proportion
-			arr_df = pd.DataFrame({'proportion': arr_hist / np.sum(arr_hist), 'left': edges[:-1], 'right': edges[1:] })
-
-			# Format the proportion 
-			arr_df['f_proportion'] = ['%0.5f' % proportion for proportion in arr_df['proportion']]
-
-			# Format the interval
-			arr_df['f_interval'] = ['%d to %d minutes' % (left, right) for left, right in zip(arr_df['left'], arr_df['right'])]
-
-			# Assign the carrier for labels
-			arr_df['name'] = carrier_name
+		# Color each carrier differently, the same color whatever else is
+		# selected so rows of unchanged carriers never need to be resent
+		colors = [color_dict[carrier] for carrier in carrier_list]
+		snapshot = datasets.snapshot
 
-			# Color each carrier differently
-			arr_df['color'] = Category20_16[i]
+		# Proportions for every carrier from the prefix sums of the cube,
+		# shared with the other sessions showing the same state
+		by_carrier = cached_dataset(
+			lambda: carrier_histograms(snapshot.index, carrier_list, colors, range_start,
+									   range_end, bin_width, cube = snapshot.cube),
+			'histogram', carriers = carrier_list, range_start = range_start,
+			range_end = range_end, bin_width = bin_width, version = snapshot.version)
 
-			# Add to the overall dataframe
-			by_carrier = by_carrier.append(arr_df)
-
-		# Overall dataframe
-		by_carrier = by_carrier.sort_values(['name', 'left'])
-
-		return ColumnDataSource(by_carrier)
+		return ColumnDataSource(data = copy_columns(by_carrier))
 
 	def style(p):
 		# Title 
@@ -91,8 +76,8 @@ def histogram_tab(flights):
 
 		# Hover tool with vline mode
 		hover = HoverTool(tooltips=[('Carrier', '@name'), 
-									('Delay', '@f_interval'),
-									('Proportion', '@f_proportion')],
+									('Delay', '@left{0} to @right{0} minutes'),
+									('Proportion', '@proportion{0.00000}')],
 						  mode='vline')
 
 		p.add_tools(hover)
@@ -106,36 +91,64 @@ def histogram_tab(flights):
 	
 	def update(attr, old, new):
 		carriers_to_plot = [carrier_selection.labels[i] for i in carrier_selection.active]
-		
-		new_src = make_dataset(carriers_to_plot,
-							   range_start = range_select.value[0],
-							   range_end = range_select.value[1],
-							   bin_width = binwidth_select.value)
-		
-		
-
-		src.data.update(new_src.data)
+		colors = [color_dict[carrier] for carrier in carriers_to_plot]
+		range_start, range_end = range_select.value
+		bin_width = binwidth_select.value
+		snapshot = datasets.snapshot
+
+		key, data = lookup_dataset('histogram', carriers = carriers_to_plot,
+								   range_start = range_start, range_end = range_end,
+								   bin_width = bin_width, version = snapshot.version)
+
+		# Only send the rows and columns that changed
+		def show(data):
+			update_source(src, copy_columns(data), key = 'name')
+
+		if data is not None:
+			show(data)
+			return
+
+		# Bin each carrier on the compute threads, all from this snapshot
+		edges = bin_edges(range_start, range_end, bin_width)
+
+		def apply(props):
+			props = np.vstack(props) if props else np.empty((0, len(edges) - 1))
+			show(dataset_cache.put(key, histogram_columns(carriers_to_plot, colors,
+														  props, edges)))
+
+		scheduler.offload([partial(carrier_proportions, snapshot.index, [carrier], edges,
+								   snapshot.cube)
+						   for carrier in carriers_to_plot], apply)
 		
 	# Carriers and colors
-	available_carriers = list(set(flights['name']))
-	available_carriers.sort()
+	available_carriers = list(datasets.index.carriers)
 
 
 	airline_colors = Category20_16
 	airline_colors.sort()
+
+	# Dictionary mapping carriers to colors
+	color_dict = {carrier: airline_colors[i % len(airline_colors)]
+				  for i, carrier in enumerate(available_carriers)}
 		
+	# Bursts of widget changes run a single update
+	scheduler = CallbackScheduler(update, tab = 'histogram')
+
 	carrier_selection = CheckboxGroup(labels=available_carriers, 
 									  active = [0, 1])
-	carrier_selection.on_change('active', update)
+	scheduler.watch(carrier_selection, 'active', name = 'carriers')
 	
 	binwidth_select = Slider(start = 1, end = 30, 
 							 step = 1, value = 5,
 							 title = 'Bin Width (min)')
-	binwidth_select.on_change('value', update)
+	scheduler.watch(binwidth_select, 'value')
 	
 	range_select = RangeSlider(start = -60, end = 180, value = (-60, 120),
 							   step = 5, title = 'Range of Delays (min)')
-	range_select.on_change('value', update)
+	scheduler.watch(range_select, 'value')
+
+	# Redraw with new flights as they come in
+	listen(lambda ready: scheduler.run('data', None, None, ready = ready))
 	
 	# Initial carriers and data source
 	initial_carriers = [carrier_selection.labels[i] for i in carrier_selection.active]
@@ -0,0 +1,266 @@
+# Precomputed lookups into the flights frame
+#
+# Callbacks used to filter the whole frame with boolean masks
+# (flights[flights['name'] == carrier]), which is a full scan for every
+# carrier on every widget change. The index is built once per process:
+# carriers and airports are dictionary encoded, the delays are stored
+# sorted by carrier with an offset table, and a second copy is sorted by
+# route (origin, dest, carrier) so any subset is a slice of an array.
+#
+# The arrays can be saved to .npy files and mapped back read-only, so
+# server processes started from the same files share one copy of them.
+#
+# Rows added while the server runs go into a small FlightIndex of their
+# own, and a SegmentedIndex answers the lookups for the mapped index and
+# that delta together, so taking in new rows does not sort the old ones
+# again or copy them out of the mapped files.
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Bumped when the layout of the saved index changes
+INDEX_VERSION = 1
+
+# Arrays written by save(), everything else is rebuilt from them
+ARRAYS = ['delays', 'origin_codes', 'dest_codes', 'carrier_offsets',
+		  'route_delays', 'route_carrier_codes', 'group_starts', 'group_keys']
+
+# Smallest signed integer type able to hold the codes for n labels
+def code_dtype(n):
+	for dtype in (np.int8, np.int16, np.int32):
+		if n < np.iinfo(dtype).max:
+			return dtype
+	return np.int64
+
+# Positions of a column's values in a dictionary (an Index). Categorical
+# columns are looked up by category, not row by row.
+def encode(column, dictionary):
+	if isinstance(column.dtype, pd.CategoricalDtype):
+		return dictionary.get_indexer(column.cat.categories)[column.cat.codes.values]
+	return dictionary.get_indexer(column)
+
+class FlightIndex(object):
+
+	def __init__(self, flights):
+		delays = flights['arr_delay'].values
+
+		# Dictionary encode the carrier names (sorted alphabetically)
+		carriers = pd.Index(sorted(set(pd.unique(flights['name']))))
+		self.carriers = list(carriers)
+		carrier_codes = encode(flights['name'], carriers).astype(code_dtype(len(carriers)))
+
+		# Origin and destination share one airport dictionary
+		airports = pd.Index(sorted(set(pd.unique(flights['origin'])) |
+								   set(pd.unique(flights['dest']))))
+		self.airports = list(airports)
+		airport_dtype = code_dtype(len(airports))
+		origin_codes = encode(flights['origin'], airports).astype(airport_dtype)
+		dest_codes = encode(flights['dest'], airports).astype(airport_dtype)
+
+		# Rows sorted by carrier with offsets marking where each carrier starts
+		order = np.argsort(carrier_codes, kind='stable')
+		self.delays = delays[order]
+		self.origin_codes = origin_codes[order]
+		self.dest_codes = dest_codes[order]
+		self.carrier_offsets = np.searchsorted(carrier_codes[order],
+											   np.arange(len(carriers) + 1))
+
+		# Rows sorted by route, and by carrier within each route
+		n_airports = len(airports)
+		route_keys = ((origin_codes.astype(np.int64) * n_airports + dest_codes)
+					  * len(carriers) + carrier_codes)
+		order = np.argsort(route_keys, kind='stable')
+		self.route_delays = delays[order]
+		self.route_carrier_codes = carrier_codes[order]
+
+		# First row and key of each (origin, dest, carrier) group, the
+		# lookups below are built from these
+		sorted_keys = route_keys[order]
+		self.group_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+		self.group_keys = sorted_keys[self.group_starts]
+
+		# Source of the rows when mapped from files written by save()
+		self.source = None
+
+		self.build_lookups()
+
+	# Dictionaries for looking up carriers, airports and routes
+	def build_lookups(self):
+		self._carrier_lookup = {carrier: i for i, carrier in enumerate(self.carriers)}
+		self._airport_lookup = {airport: i for i, airport in enumerate(self.airports)}
+
+		n_carriers = len(self.carriers)
+		n_airports = len(self.airports)
+
+		# (origin, dest) -> (start, stop) rows in the route sorted arrays, and
+		# (origin, dest) -> {carrier: delays} for every carrier on the route,
+		# views into the route sorted delays. The groups of a route follow
+		# each other.
+		self.route_ranges = {}
+		self.route_carriers = {}
+		stops = np.r_[self.group_starts[1:], len(self.route_delays)]
+		for start, stop, key in zip(self.group_starts.tolist(), stops.tolist(),
+									self.group_keys.tolist()):
+			route_id, carrier = divmod(key, n_carriers)
+			origin, dest = divmod(route_id, n_airports)
+			route = (self.airports[origin], self.airports[dest])
+
+			first, _ = self.route_ranges.get(route, (start, stop))
+			self.route_ranges[route] = (first, stop)
+			self.route_carriers.setdefault(route, {})[self.carriers[carrier]] = \
+				self.route_delays[start:stop]
+
+		# Origin -> destinations with a direct flight (sorted, like the
+		# routes themselves)
+		self.destinations = {}
+		for origin, dest in self.route_ranges:
+			self.destinations.setdefault(origin, []).append(dest)
+
+		self.origins = sorted(self.destinations)
+		self.dests = sorted(set(dest for _, dest in self.route_ranges))
+
+	# Write the arrays to .npy files in directory. source identifies the
+	# rows the index was built from, load() only maps an index back for the
+	# same source.
+	def save(self, directory, source):
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		for name in ARRAYS:
+			np.save(os.path.join(directory, name + '.npy'), getattr(self, name))
+
+		# Written last, so an index that was not finished is never read
+		meta = {'version': INDEX_VERSION, 'source': source,
+				'carriers': self.carriers, 'airports': self.airports}
+		with open(os.path.join(directory, 'meta.json'), 'w') as f:
+			json.dump(meta, f)
+
+	# Index with its arrays mapped read-only from a directory written by
+	# save() (None if there is none for this source)
+	@classmethod
+	def load(cls, directory, source):
+		try:
+			with open(os.path.join(directory, 'meta.json')) as f:
+				meta = json.load(f)
+		except (IOError, ValueError):
+			return None
+
+		if meta['version'] != INDEX_VERSION or meta['source'] != source:
+			return None
+
+		index = cls.__new__(cls)
+		index.source = source
+		index.carriers = meta['carriers']
+		index.airports = meta['airports']
+		for name in ARRAYS:
+			setattr(index, name, np.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+
+		index.build_lookups()
+		return index
+
+	def __len__(self):
+		return len(self.delays)
+
+	@property
+	def nbytes(self):
+		return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+	def has_carrier(self, carrier):
+		return carrier in self._carrier_lookup
+
+	def carrier_code(self, carrier):
+		return self._carrier_lookup[carrier]
+
+	def airport_code(self, airport):
+		return self._airport_lookup[airport]
+
+	# Rows for one carrier in the carrier sorted arrays
+	def carrier_slice(self, carrier):
+		code = self.carrier_code(carrier)
+		return slice(int(self.carrier_offsets[code]),
+					 int(self.carrier_offsets[code + 1]))
+
+	# Arrival delays for one carrier (a view, not a copy)
+	def carrier_delays(self, carrier):
+		return self.delays[self.carrier_slice(carrier)]
+
+	# Rows for one route in the route sorted arrays (empty if never flown)
+	def route_slice(self, origin, dest):
+		start, stop = self.route_ranges.get((origin, dest), (0, 0))
+		return slice(start, stop)
+
+	# Delays on a route split by carrier: {carrier: delays view}
+	def route_carrier_delays(self, origin, dest):
+		return self.route_carriers.get((origin, dest), {})
+
+	# Destinations reachable from an origin with a direct flight
+	def reachable(self, origin):
+		return self.destinations.get(origin, [])
+
+# Lookups of a base index with the rows added since in a delta index. A
+# carrier's or a route's delays are the base view followed by the delta's,
+# concatenated the first time they are asked for.
+class SegmentedIndex(object):
+
+	def __init__(self, base, delta):
+		self.base = base
+		self.delta = delta
+
+		self.carriers = base.carriers + [carrier for carrier in delta.carriers
+										 if not base.has_carrier(carrier)]
+
+		self.destinations = dict(base.destinations)
+		for origin, dests in delta.destinations.items():
+			self.destinations[origin] = sorted(set(self.destinations.get(origin, [])) | set(dests))
+
+		self.origins = sorted(self.destinations)
+		self.dests = sorted(set(base.dests) | set(delta.dests))
+
+		# Merged delays, filled as they are asked for (by any thread, the
+		# same value is computed if two of them ask at once)
+		self._carrier_delays = {}
+		self._route_carriers = {}
+
+	def __len__(self):
+		return len(self.base) + len(self.delta)
+
+	@property
+	def nbytes(self):
+		return self.base.nbytes + self.delta.nbytes
+
+	# Arrival delays for one carrier
+	def carrier_delays(self, carrier):
+		if not self.delta.has_carrier(carrier):
+			return self.base.carrier_delays(carrier)
+		if not self.base.has_carrier(carrier):
+			return self.delta.carrier_delays(carrier)
+
+		delays = self._carrier_delays.get(carrier)
+		if delays is None:
+			delays = np.concatenate([self.base.carrier_delays(carrier),
+									 self.delta.carrier_delays(carrier)])
+			self._carrier_delays[carrier] = delays
+		return delays
+
+	# Delays on a route split by carrier: {carrier: delays}, by carrier name
+	def route_carrier_delays(self, origin, dest):
+		added = self.delta.route_carrier_delays(origin, dest)
+		if not added:
+			return self.base.route_carrier_delays(origin, dest)
+
+		by_carrier = self._route_carriers.get((origin, dest))
+		if by_carrier is None:
+			by_carrier = dict(self.base.route_carrier_delays(origin, dest))
+			for carrier, delays in added.items():
+				by_carrier[carrier] = (np.concatenate([by_carrier[carrier], delays])
+									   if carrier in by_carrier else delays)
+			by_carrier = dict(sorted(by_carrier.items()))
+			self._route_carriers[(origin, dest)] = by_carrier
+		return by_carrier
+
+	# Destinations reachable from an origin with a direct flight
+	def reachable(self, origin):
+		return self.destinations.get(origin, [])
@@ -0,0 +1,300 @@
+# Live ingestion of new flights while the server runs
+#
+# A background thread watches an append-only csv file (only the bytes
+# added since the last look are read) or a drop directory (every new csv
+# file is read once). New rows are parsed in batches and a new snapshot of
+# the shared data (see scripts/registry.py) is built from them off the
+# server loop, where the delay cube and the carrier statistics take in just
+# the new rows. The snapshot is then swapped in on the server loop, and
+# every open session is told to refresh on its next tick. The tabs send the
+# changes with update_source, so sessions get stream/patch messages rather
+# than whole new sources.
+#
+# Throughput (rows parsed and folded per second of work) and freshness
+# (time from a row landing on disk to a tab having redrawn with it) are
+# logged after every batch and returned by Ingestor.report(). A tab calls
+# back when its update is applied, which for offloaded work is after the
+# results came back from the compute threads. Hidden tabs catch up when
+# they are shown, they are not counted.
+#
+# Drop directory files have to appear whole: write them under another
+# name and rename them into the directory, like the writer below does.
+#
+# Write test rows while the server runs, from the bokeh_app directory:
+#     python -m scripts.ingest data/live.csv --rows 500 --interval 1
+
+import argparse
+import collections
+import glob
+import io
+import logging
+import os
+import threading
+import time
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from scripts.config import INGEST_INTERVAL_MS
+from scripts.registry import FLIGHTS_COLUMNS, DATA_DIR, validate
+
+logger = logging.getLogger(__name__)
+
+# Largest chunk of a tailed file read in one batch
+MAX_BATCH_BYTES = 16 * 2 ** 20
+
+# Session document -> callbacks refreshing its tabs with new rows
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+# Refresh a tab of the current session when new rows are folded in.
+# callback(ready) calls ready() once the tab has been redrawn.
+def listen(callback, doc = None):
+	if doc is None:
+		from bokeh.io import curdoc
+		doc = curdoc()
+
+	with _listeners_lock:
+		_listeners.setdefault(doc, []).append(callback)
+
+# Stop refreshing a session (called when the session is destroyed)
+def forget(doc):
+	with _listeners_lock:
+		_listeners.pop(doc, None)
+
+# New lines of an append-only csv file
+class FileTail(object):
+
+	def __init__(self, path, from_end = False):
+		self.path = path
+		self.header = None
+		self.offset = 0
+
+		# Skip the rows already in the file, for tailing the loaded file
+		if from_end and os.path.exists(path):
+			self.offset = os.path.getsize(path)
+
+	# [(header, text, modified time)] of the complete lines added since the
+	# last read, a partly written last line is left for the next read
+	def read(self):
+		if not os.path.exists(self.path):
+			return []
+
+		stat = os.stat(self.path)
+
+		# Truncated or replaced: start again from the top
+		if stat.st_size < self.offset:
+			logger.warning('%s was truncated, reading it from the start', self.path)
+			self.offset = 0
+			self.header = None
+
+		if stat.st_size == self.offset and self.header is not None:
+			return []
+
+		with open(self.path, 'rb') as f:
+			if self.header is None:
+				self.header = f.readline().decode('utf-8')
+				self.offset = max(self.offset, f.tell())
+			f.seek(self.offset)
+			chunk = f.read(MAX_BATCH_BYTES)
+
+		end = chunk.rfind(b'\n') + 1
+		if end == 0:
+			return []
+
+		self.offset += end
+		return [(self.header, chunk[:end].decode('utf-8'), stat.st_mtime)]
+
+# New csv files in a drop directory
+class DropDirectory(object):
+
+	def __init__(self, path):
+		self.path = path
+		self.seen = set()
+
+	def read(self):
+		batch = []
+		for filename in sorted(glob.glob(os.path.join(self.path, '*.csv'))):
+			if filename in self.seen:
+				continue
+			self.seen.add(filename)
+
+			with open(filename) as f:
+				header = f.readline()
+				batch.append((header, f.read(), os.path.getmtime(filename)))
+
+		return batch
+
+# Source for a path: a directory is a drop directory, anything else a file
+def open_source(path, from_end = False):
+	if os.path.isdir(path):
+		return DropDirectory(path)
+	return FileTail(path, from_end = from_end)
+
+# Rows of csv text in the layout of flights.csv (with or without the
+# unnamed index column)
+def parse_rows(header, text):
+	index_col = 0 if header.startswith(',') else None
+	rows = pd.read_csv(io.StringIO(header + text), index_col = index_col)
+	validate(rows, FLIGHTS_COLUMNS, 'new flights', numeric = ['arr_delay'])
+	return rows.dropna()
+
+# New rows ready to fold in, with the snapshot built from them
+class Batch(object):
+
+	def __init__(self, rows, snapshot, arrived, seconds):
+		self.rows = rows
+		self.snapshot = snapshot
+		# Oldest modified time of the files the rows came from
+		self.arrived = arrived
+		# Time spent parsing and building
+		self.seconds = seconds
+		self.folded = threading.Event()
+
+class Ingestor(object):
+
+	def __init__(self, datasets, source, interval = INGEST_INTERVAL_MS):
+		self.datasets = datasets
+		self.source = source
+		self.interval = interval
+
+		self.rows = 0
+		self.batches = 0
+		self.errors = 0
+		self.busy_seconds = 0.0
+
+		# Freshness of the latest tab redraws (seconds)
+		self.freshness = collections.deque(maxlen = 1000)
+
+		self.io_loop = None
+		self._stop = threading.Event()
+		self._thread = None
+
+	# Read, parse and build the next batch (None if there are no new rows)
+	def poll(self):
+		start = time.time()
+		frames, arrived = [], None
+		for header, text, modified in self.source.read():
+			try:
+				rows = parse_rows(header, text)
+			except (ValueError, pd.errors.ParserError):
+				logger.exception('Skipping new flights that could not be read')
+				self.errors += 1
+				continue
+
+			if len(rows):
+				frames.append(rows)
+				arrived = modified if arrived is None else min(arrived, modified)
+
+		if not frames:
+			return None
+
+		rows = pd.concat(frames)
+		return Batch(rows, self.datasets.extended(rows), arrived, time.time() - start)
+
+	# Fold a batch into the shared data and refresh every session
+	def fold(self, batch):
+		start = time.time()
+		self.datasets.fold(batch.snapshot)
+
+		self.rows += len(batch.rows)
+		self.batches += 1
+		self.busy_seconds += batch.seconds + time.time() - start
+		batch.folded.set()
+
+		with _listeners_lock:
+			listeners = [(doc, list(callbacks)) for doc, callbacks in _listeners.items()]
+
+		for doc, callbacks in listeners:
+			doc.add_next_tick_callback(partial(self.refresh, callbacks, batch))
+
+		self.log(batch)
+
+	# Next tick callback of one session
+	def refresh(self, callbacks, batch):
+		for callback in callbacks:
+			callback(partial(self.ready, batch))
+
+	# A tab has been redrawn with the rows of the batch
+	def ready(self, batch):
+		self.freshness.append(time.time() - batch.arrived)
+
+	def log(self, batch):
+		report = self.report()
+		logger.info('Ingested %d rows in %.0f ms (%d rows total, %.0f rows/s), '
+					'freshness mean %s ms, max %s ms',
+					len(batch.rows), 1000 * batch.seconds, report['rows'],
+					report['rows_per_second'], report['freshness_ms']['mean'],
+					report['freshness_ms']['max'])
+
+	def report(self):
+		freshness = np.array(self.freshness) * 1000
+		return {'rows': self.rows,
+				'batches': self.batches,
+				'errors': self.errors,
+				'rows_per_second': round(self.rows / self.busy_seconds, 1) if self.busy_seconds else 0.0,
+				'freshness_ms': {'last': round(float(freshness[-1]), 1) if len(freshness) else None,
+								 'mean': round(float(freshness.mean()), 1) if len(freshness) else None,
+								 'max': round(float(freshness.max()), 1) if len(freshness) else None}}
+
+	# Poll in a background thread and fold on the server loop
+	def start(self, io_loop = None):
+		from tornado.ioloop import IOLoop
+		self.io_loop = io_loop if io_loop is not None else IOLoop.current()
+
+		self._thread = threading.Thread(target=self.run, name='flights-ingest')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+
+	def run(self):
+		while not self._stop.wait(self.interval / 1000):
+			try:
+				batch = self.poll()
+			except Exception:
+				logger.exception('Reading new flights failed')
+				self.errors += 1
+				continue
+
+			if batch is not None:
+				self.io_loop.add_callback(self.fold, batch)
+
+				# The next batch is built on top of this one
+				batch.folded.wait()
+
+# Append rows sampled from flights.csv to a file, or drop them as new files
+# into a directory, to try the ingestion locally
+def write_rows(target, source, n_rows, interval, batches, seed = 0):
+	flights = pd.read_csv(source, index_col = 0).dropna()
+	rng = np.random.RandomState(seed)
+
+	for i in range(batches):
+		rows = flights.iloc[rng.randint(len(flights), size = n_rows)]
+
+		if os.path.isdir(target):
+			filename = os.path.join(target, 'flights-%d-%05d.csv' % (os.getpid(), i))
+			rows.to_csv(filename + '.tmp')
+			os.replace(filename + '.tmp', filename)
+		else:
+			header = not os.path.exists(target) or os.path.getsize(target) == 0
+			with open(target, 'a') as f:
+				rows.to_csv(f, header = header)
+
+		print('Wrote %d rows to %s' % (n_rows, target))
+		if i < batches - 1:
+			time.sleep(interval)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Write new flights for the server to take in')
+	parser.add_argument('target', help = 'csv file to append to, or directory to drop files into')
+	parser.add_argument('--source', default = os.path.join(DATA_DIR, 'flights.csv'))
+	parser.add_argument('--rows', type = int, default = 500, help = 'rows per batch')
+	parser.add_argument('--interval', type = float, default = 1.0, help = 'seconds between batches')
+	parser.add_argument('--batches', type = int, default = 10)
+	args = parser.parse_args()
+
+	write_rows(args.target, args.source, args.rows, args.interval, args.batches)
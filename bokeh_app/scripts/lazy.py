@@ -0,0 +1,47 @@
+# Tabs built the first time they are shown
+#
+# Building every tab for every session means fitting densities and
+# drawing plots most users never look at. LazyTabs starts each tab as a
+# placeholder and only builds the active one. The others are built when
+# Tabs.active first switches to them. Schedulers of hidden tabs are hidden
+# too, so their updates wait until the tab is shown again.
+
+from bokeh.models import Panel
+from bokeh.models.widgets import Div, Tabs
+
+from scripts.scheduler import collect
+
+class LazyTabs(object):
+
+	# tabs: list of (title, function returning the tab's Panel)
+	def __init__(self, tabs, active = 0):
+		self.titles = [title for title, _ in tabs]
+		self.factories = [factory for _, factory in tabs]
+
+		# Schedulers of each tab once it has been built
+		self.schedulers = [None] * len(tabs)
+
+		self.panels = [Panel(child = Div(text = 'Loading %s...' % title), title = title)
+					   for title in self.titles]
+		self.tabs = Tabs(tabs = self.panels, active = active)
+
+		self.build(active)
+		self.tabs.on_change('active', self.switch)
+
+	def build(self, i):
+		with collect() as schedulers:
+			panel = self.factories[i]()
+
+		self.schedulers[i] = schedulers
+		self.panels[i].child = panel.child
+
+	def switch(self, attr, old, new):
+		if old is not None and self.schedulers[old] is not None:
+			for scheduler in self.schedulers[old]:
+				scheduler.hide()
+
+		if self.schedulers[new] is None:
+			self.build(new)
+		else:
+			for scheduler in self.schedulers[new]:
+				scheduler.show()
@@ -0,0 +1,325 @@
+# Compact loading of the flights csv through an on-disk columnar cache
+#
+# Reading flights.csv with default settings keeps every column, stores the
+# names and airport codes as one python string per row and the numbers as
+# float64, and dropna() then copies the whole frame. The tabs only use
+# four columns, so the loader:
+#
+#   - reads only those columns, in chunks, so the csv can be larger than
+#     memory
+#   - stores carrier names and airports as integer codes into a
+#     dictionary (categoricals) and arrival delays as float32
+#   - writes each column to a .npy file in the cache directory as the
+#     chunks are read
+#
+# Later starts map the .npy files (np.load with mmap_mode) instead of
+# parsing the csv again. The cache is rebuilt when the size or modified
+# time of the csv changes. Rows with a missing value in one of the loaded
+# columns are dropped.
+#
+# The FlightIndex built from the flights is saved in the cache as well
+# (load_index), so server processes started from the same cache map one
+# shared, read-only copy of the flights and the index instead of each
+# building its own. Building the cache holds a lock on the cache
+# directory, so processes starting together build it only once.
+#
+# Rows taken in while the server runs are kept in memory (see
+# scripts/registry.py) until there are enough of them to compact: the
+# mapped columns and the new rows are then written to a segment of the
+# cache with its own index, which is mapped back like the cache itself.
+# Segments are named after the rows they hold, so processes taking in the
+# same rows write a segment once and share it. A compaction removes the
+# segment it started from; segments left by stopped processes are removed
+# when the cache is rebuilt.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from scripts.index import FlightIndex, code_dtype
+
+# File locks are not available on Windows, where the server runs a single
+# process anyway
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the layout of the cache changes
+CACHE_VERSION = 1
+
+# Columns stored as dictionary codes, and the type of the numeric ones
+CATEGORICAL_COLUMNS = ['name', 'origin', 'dest']
+NUMERIC_TYPES = {'arr_delay': np.float32}
+
+# Size and modified time of the csv the cache was built from
+def source_key(path):
+	stat = os.stat(path)
+	return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def read_meta(cache_dir):
+	try:
+		with open(os.path.join(cache_dir, 'meta.json')) as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+# Frame of categoricals and downcast numbers mapped from the cache (None
+# if the cache is missing or was built from a different csv)
+def read_cache(path, cache_dir, columns):
+	return map_columns(cache_dir, columns, source_key(path))
+
+# Frame mapped from the .npy files of a cache or segment directory (None if
+# it is missing or was written for another source)
+def map_columns(directory, columns, source):
+	meta = read_meta(directory)
+	if (meta is None or meta['version'] != CACHE_VERSION or meta['columns'] != columns
+		or meta['source'] != source):
+		return None
+
+	data = {}
+	for column in columns:
+		values = np.load(os.path.join(directory, column + '.npy'), mmap_mode='r')
+		if column in meta['dictionaries']:
+			values = pd.Categorical.from_codes(values, meta['dictionaries'][column])
+		data[column] = values
+
+	# Without a copy the columns stay mapped from the files
+	return pd.DataFrame(data, copy=False)
+
+# Held while the cache is checked and built, so only one process builds it
+@contextmanager
+def cache_lock(cache_dir):
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+
+	with open(os.path.join(cache_dir, '.lock'), 'w') as f:
+		if fcntl is not None:
+			fcntl.flock(f, fcntl.LOCK_EX)
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(f, fcntl.LOCK_UN)
+
+# Stream the csv in chunks into one .npy file per column
+def build_cache(path, cache_dir, columns, chunk_rows = 1000000):
+	start = time.time()
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+
+	# Label -> code for every categorical column, growing chunk by chunk
+	dictionaries = {column: {} for column in columns if column in CATEGORICAL_COLUMNS}
+	dtypes = {column: NUMERIC_TYPES.get(column, object) for column in columns}
+
+	raw = {column: open(os.path.join(cache_dir, column + '.raw'), 'wb') for column in columns}
+	n_rows = 0
+	try:
+		for chunk in pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunk_rows):
+			chunk = chunk.dropna()
+			n_rows += len(chunk)
+
+			for column in columns:
+				values = chunk[column].values
+				if column in dictionaries:
+					values = encode(values, dictionaries[column])
+				values.tofile(raw[column])
+	finally:
+		for f in raw.values():
+			f.close()
+
+	# Write the .npy files with the smallest code type, a block at a time
+	for column in columns:
+		raw_path = os.path.join(cache_dir, column + '.raw')
+		if column in dictionaries:
+			raw_dtype, dtype = np.int32, code_dtype(len(dictionaries[column]))
+		else:
+			raw_dtype = dtype = NUMERIC_TYPES[column]
+
+		source = np.memmap(raw_path, dtype=raw_dtype, mode='r', shape=(n_rows,))
+		target = np.lib.format.open_memmap(os.path.join(cache_dir, column + '.npy'),
+										   mode='w+', dtype=dtype, shape=(n_rows,))
+		for block in range(0, n_rows, chunk_rows):
+			target[block:block + chunk_rows] = source[block:block + chunk_rows]
+		target.flush()
+		del source, target
+		os.remove(raw_path)
+
+	# The meta file is written last, so a cache that was not finished is
+	# never read
+	meta = {'version': CACHE_VERSION, 'columns': columns, 'rows': n_rows,
+			'source': source_key(path),
+			'dictionaries': {column: sorted(labels, key=labels.get)
+							 for column, labels in dictionaries.items()}}
+	with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+		json.dump(meta, f)
+
+	logger.info('Cached %d rows of %s in %s in %.2fs', n_rows, path, cache_dir,
+				time.time() - start)
+
+# Codes of the labels in a chunk, adding new labels to the dictionary
+def encode(values, dictionary):
+	labels, codes = np.unique(values.astype(str), return_inverse=True)
+	lookup = np.array([dictionary.setdefault(label, len(dictionary)) for label in labels],
+					  dtype=np.int32)
+	return lookup[codes]
+
+# Flights frame with only the given columns, from the cache when it is up
+# to date and building the cache from the csv first when it is not
+def load_flights(path, columns, cache_dir, chunk_rows = 1000000):
+	meta_path = os.path.join(cache_dir, 'meta.json')
+
+	flights = read_cache(path, cache_dir, columns)
+	if flights is not None:
+		return flights
+
+	with cache_lock(cache_dir):
+		# Another process may have built it while this one waited
+		flights = read_cache(path, cache_dir, columns)
+		if flights is None:
+			if os.path.exists(meta_path):
+				os.remove(meta_path)
+
+			# Segments compacted from the rows of the old csv
+			shutil.rmtree(os.path.join(cache_dir, 'segments'), ignore_errors=True)
+			build_cache(path, cache_dir, columns, chunk_rows)
+			flights = read_cache(path, cache_dir, columns)
+
+	return flights
+
+# Index of flights loaded from the cache, mapped from the cache when it was
+# saved for the same rows and built and saved first when it was not
+def load_index(flights, cache_dir):
+	index_dir = os.path.join(cache_dir, 'index')
+	meta = read_meta(cache_dir)
+	source = dict(meta['source'], rows=meta['rows'])
+
+	index = FlightIndex.load(index_dir, source)
+	if index is not None:
+		return index
+
+	with cache_lock(cache_dir):
+		index = FlightIndex.load(index_dir, source)
+		if index is None:
+			start = time.time()
+			FlightIndex(flights).save(index_dir, source)
+			index = FlightIndex.load(index_dir, source)
+			logger.info('Cached the index of %d rows in %s in %.2fs', len(flights),
+						index_dir, time.time() - start)
+
+	return index
+
+# Index of flights saved in directory for source and mapped back, or
+# mapped straight away when it was already saved
+def map_index(flights, directory, source):
+	index = FlightIndex.load(directory, source)
+	if index is None:
+		FlightIndex(flights).save(directory, source)
+		index = FlightIndex.load(directory, source)
+	return index
+
+# Mapped flights and index of the rows of flights followed by rows, where
+# base is the mapped index of flights. The columns are written to a segment
+# of the cache a block at a time, and the index is built from the mapped
+# segment. The segment the flights were mapped from before is removed, the
+# arrays already mapped from it stay readable.
+def compact_rows(flights, base, rows, cache_dir):
+	start = time.time()
+	columns = list(flights.columns)
+	n_rows = len(flights) + len(rows)
+
+	# The segment is named after the rows it holds
+	digest = hashlib.sha1(json.dumps(base.source, sort_keys=True).encode())
+	for column in columns:
+		values = rows[column].values
+		if values.dtype == object:
+			digest.update('\n'.join(values.astype(str)).encode())
+		else:
+			digest.update(np.ascontiguousarray(values).tobytes())
+	source = {'base': base.source, 'rows': n_rows, 'digest': digest.hexdigest()}
+	directory = os.path.join(cache_dir, 'segments', source['digest'][:16])
+
+	with cache_lock(cache_dir):
+		compacted = map_columns(directory, columns, source)
+		if compacted is None:
+			write_segment(flights, rows, directory, source)
+			compacted = map_columns(directory, columns, source)
+		index = map_index(compacted, os.path.join(directory, 'index'), source)
+
+		previous = base.source.get('digest') if isinstance(base.source, dict) else None
+		if previous is not None and previous != source['digest']:
+			shutil.rmtree(os.path.join(cache_dir, 'segments', previous[:16]), ignore_errors=True)
+
+	logger.info('Compacted %d new rows into %s (%d rows) in %.2fs', len(rows), directory,
+				n_rows, time.time() - start)
+	return compacted, index
+
+# Write the columns of flights followed by rows to directory in the layout
+# of the cache. Categorical columns keep their codes, new labels are added
+# at the end of the dictionaries.
+def write_segment(flights, rows, directory, source, block_rows = 1000000):
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	meta_path = os.path.join(directory, 'meta.json')
+	if os.path.exists(meta_path):
+		os.remove(meta_path)
+
+	dictionaries = {}
+	for column in flights.columns:
+		values = flights[column]
+		if isinstance(values.dtype, pd.CategoricalDtype):
+			labels = list(values.cat.categories)
+			known = set(labels)
+			labels += [label for label in pd.unique(rows[column].values.astype(str))
+					   if label not in known]
+			dictionaries[column] = labels
+
+			old = values.cat.codes.values
+			new = pd.Index(labels).get_indexer(rows[column].values.astype(str))
+			dtype = code_dtype(len(labels))
+		else:
+			old = values.values
+			new = rows[column].values
+			dtype = values.dtype
+
+		target = np.lib.format.open_memmap(os.path.join(directory, column + '.npy'), mode='w+',
+										   dtype=dtype, shape=(len(flights) + len(rows),))
+		for block in range(0, len(old), block_rows):
+			stop = min(block + block_rows, len(old))
+			target[block:stop] = old[block:stop]
+		target[len(old):] = new
+		target.flush()
+		del target
+
+	# Written last, like the meta of the cache
+	meta = {'version': CACHE_VERSION, 'columns': list(flights.columns),
+			'rows': len(flights) + len(rows), 'source': source, 'dictionaries': dictionaries}
+	with open(meta_path, 'w') as f:
+		json.dump(meta, f)
+
+# Flights frame with new rows added, keeping the categorical columns as
+# codes (the categories grow with any new labels). The columns are copied
+# out of the mapped files, used when there is no cache to compact into.
+def append_rows(flights, rows):
+	data = {}
+	for column in flights.columns:
+		values = flights[column]
+		if isinstance(values.dtype, pd.CategoricalDtype):
+			data[column] = pd.api.types.union_categoricals(
+				[values.values, pd.Categorical(rows[column].values)])
+		else:
+			data[column] = np.concatenate([values.values,
+										   rows[column].values.astype(values.dtype)])
+
+	return pd.DataFrame(data)
@@ -0,0 +1,186 @@
+# Performance metrics of the tab callbacks, in Prometheus text format
+#
+# The schedulers time every tab update: how long it waited after the
+# widget event, how long the callback ran on the server loop, how long
+# applying the results of work offloaded to the compute threads took, and
+# the whole time from the widget event until the update is in the document
+# ready to render. The tabs time their dataset functions and count the
+# flight rows they read (none when the delay cube or the carrier
+# statistics answer), and update_source records how many rows each source
+# update sent and an estimate of their bytes. Everything goes into
+# histograms labelled by tab (and widget or update kind). MetricsHandler
+# serves them at /metrics when the app runs through serve.py, for
+# Prometheus to scrape and alert on, e.g. on
+# histogram_quantile(0.99, flights_update_seconds_bucket). The hits,
+# misses and size of the shared caches are served too, their hit rate is
+# rate(flights_cache_hits_total) / (rate(flights_cache_hits_total) +
+# rate(flights_cache_misses_total)).
+#
+# Metrics are per server process, like the rest of the shared state.
+
+import threading
+import time
+
+from contextlib import contextmanager
+from functools import wraps
+
+from tornado.web import RequestHandler
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTES = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Every metric, in the order they are served
+_metrics = []
+
+# Labels of the callback running now (the server runs callbacks one at a
+# time on its loop)
+_labels = {'tab': 'none', 'widget': 'none'}
+
+def escape(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra = ()):
+	pairs = list(zip(names, values)) + list(extra)
+	return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+class Histogram(object):
+
+	def __init__(self, name, help, buckets, labels):
+		self.name = name
+		self.help = help
+		self.buckets = tuple(buckets)
+		self.labels = tuple(labels)
+
+		# Label values -> [count in each bucket, sum, count]
+		self.series = {}
+		self._lock = threading.Lock()
+
+		_metrics.append(self)
+
+	# Record a value, labels not given come from the running callback
+	def observe(self, value, **labels):
+		key = tuple(labels.get(name, _labels.get(name, 'none')) for name in self.labels)
+
+		with self._lock:
+			series = self.series.get(key)
+			if series is None:
+				series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+
+			for i, bound in enumerate(self.buckets):
+				if value <= bound:
+					series[0][i] += 1
+			series[1] += value
+			series[2] += 1
+
+	def render(self):
+		lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+
+		with self._lock:
+			for key, (counts, total, count) in sorted(self.series.items()):
+				for bound, bucket_count in zip(self.buckets, counts):
+					lines.append('%s_bucket%s %d' % (self.name, format_labels(
+						self.labels, key, [('le', repr(float(bound)))]), bucket_count))
+				lines.append('%s_bucket%s %d' % (self.name, format_labels(
+					self.labels, key, [('le', '+Inf')]), count))
+				lines.append('%s_sum%s %r' % (self.name, format_labels(self.labels, key), total))
+				lines.append('%s_count%s %d' % (self.name, format_labels(self.labels, key), count))
+
+		return lines
+
+# Counts and size of the caches given to watch_cache: (metric, type, help,
+# field of LRUCache.stats())
+CACHE_FIELDS = [('flights_cache_hits_total', 'counter', 'Lookups found in the cache', 'hits'),
+				('flights_cache_misses_total', 'counter', 'Lookups not found in the cache', 'misses'),
+				('flights_cache_evictions_total', 'counter', 'Entries evicted from the cache',
+				 'evictions'),
+				('flights_cache_entries', 'gauge', 'Entries in the cache', 'entries'),
+				('flights_cache_bytes', 'gauge', 'Approximate bytes held by the cache', 'bytes'),
+				('flights_cache_max_bytes', 'gauge', 'Byte limit of the cache', 'max_bytes')]
+
+class CacheMetrics(object):
+
+	def __init__(self):
+		self.caches = []
+		_metrics.append(self)
+
+	def render(self):
+		stats = [cache.stats() for cache in self.caches]
+
+		lines = []
+		for name, kind, help, field in CACHE_FIELDS:
+			lines += ['# HELP %s %s' % (name, help), '# TYPE %s %s' % (name, kind)]
+			lines += ['%s%s %d' % (name, format_labels(['cache'], [cache['name']]), cache[field])
+					  for cache in stats]
+		return lines
+
+callback_seconds = Histogram(
+	'flights_callback_seconds', 'Time spent running a tab update callback on the loop',
+	SECONDS, ['tab', 'widget'])
+apply_seconds = Histogram(
+	'flights_apply_seconds', 'Time spent applying offloaded results to the document',
+	SECONDS, ['tab', 'widget'])
+update_seconds = Histogram(
+	'flights_update_seconds', 'Time from the first widget event to the update being ready to render',
+	SECONDS, ['tab', 'widget'])
+callback_wait_seconds = Histogram(
+	'flights_callback_wait_seconds', 'Time from the first widget event to the update running',
+	SECONDS, ['tab', 'widget'])
+dataset_seconds = Histogram(
+	'flights_dataset_seconds', 'Time spent building a tab dataset',
+	SECONDS, ['tab'])
+rows_scanned = Histogram(
+	'flights_dataset_rows_scanned', 'Flight rows read to build a tab dataset',
+	ROWS, ['tab'])
+update_rows = Histogram(
+	'flights_update_rows', 'Rows sent to the browser by a source update',
+	ROWS, ['tab', 'kind'])
+update_bytes = Histogram(
+	'flights_update_estimated_bytes',
+	'Estimated bytes of column values sent to the browser by a source update',
+	BYTES, ['tab', 'kind'])
+
+cache_metrics = CacheMetrics()
+
+# Serve the counts of an LRUCache
+def watch_cache(cache):
+	cache_metrics.caches.append(cache)
+
+# Labels for everything recorded inside the with block
+@contextmanager
+def labels(**values):
+	previous = dict(_labels)
+	_labels.update(values)
+	try:
+		yield
+	finally:
+		_labels.clear()
+		_labels.update(previous)
+
+# Labels of the callback running now, to record with later on
+def current_labels():
+	return dict(_labels)
+
+# Decorator recording how long a function takes in a histogram
+def timed(histogram, **labels):
+	def decorator(function):
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			start = time.time()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				histogram.observe(time.time() - start, **labels)
+		return wrapper
+	return decorator
+
+# All metrics in Prometheus text format
+def render():
+	return '\n'.join(line for metric in _metrics for line in metric.render()) + '\n'
+
+# Serves render(), added to the server with extra_patterns in serve.py
+class MetricsHandler(RequestHandler):
+
+	def get(self):
+		self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.write(render())
@@ -0,0 +1,223 @@
+# Process-wide registry of the datasets shared by every session
+#
+# main.py runs once per browser session, but python modules are only
+# imported once per server process. Keeping the frames here means they
+# are read from disk a single time (from the on_server_loaded hook in
+# server_lifecycle.py) and every session gets the same objects.
+# The frames are shared, so tabs must treat them as read-only.
+#
+# The flights, the index, the delay cube and the carrier statistics are
+# held together in a Snapshot, which is never changed once made. New rows
+# make a new snapshot off the server loop, and the loop swaps it in with a
+# single assignment. Tab callbacks read datasets.snapshot once and pass it
+# on to their compute tasks, so a task sees the same rows from start to
+# end however many batches are folded in while it runs.
+#
+# New rows are kept apart from the mapped flights, in a small frame (the
+# delta) with an index of its own, and a SegmentedIndex answers for both.
+# A batch only costs an index of the delta. Once the delta reaches
+# COMPACT_ROWS rows it is compacted into a new segment of the mapped cache
+# (see scripts/loader.py), off the server loop like the rest.
+
+import logging
+import os
+import threading
+import time
+
+# Pandas for data management
+import pandas as pd
+
+# os methods for manipulating paths
+from os.path import dirname, join
+
+from scripts.binning import DelayCube
+from scripts.config import CACHE_DIR, COMPACT_ROWS
+from scripts.index import FlightIndex, SegmentedIndex
+from scripts.loader import append_rows, compact_rows, load_flights, load_index
+from scripts.route_table import RouteTable
+from scripts.stats import CarrierStats
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = join(dirname(dirname(__file__)), 'data')
+
+# Columns the tabs rely on in each dataset
+FLIGHTS_COLUMNS = ['arr_delay', 'name', 'origin', 'dest']
+MAP_COLUMNS = ['origin', 'dest', 'carrier', 'arr_delay', 'distance',
+			   'start_long', 'start_lati', 'end_long', 'end_lati']
+
+_lock = threading.Lock()
+_datasets = None
+
+# Flights and everything built from them, as of one batch of new rows
+class Snapshot(object):
+
+	def __init__(self, flights, base, cube, stats, version, delta = None, cache_dir = None):
+		# Flights and their index, mapped from cache_dir unless there is none
+		self.flights = flights
+		self.base = base
+		self.cache_dir = cache_dir
+
+		# Rows added since the flights were mapped (None if there are none)
+		self.delta = delta
+
+		# Carrier and route lookups used by the tab callbacks
+		self.index = base if delta is None else SegmentedIndex(base, FlightIndex(delta))
+
+		# Cumulative delay counts covering the range of the delay sliders
+		self.cube = cube
+		# Mergeable per carrier statistics for the Summary Table
+		self.stats = stats
+		# Number of batches of new rows folded in since loading
+		self.version = version
+
+	# Snapshot with new rows added. This is the slow part of taking in new
+	# rows and does not change this snapshot, so it can run off the server
+	# loop.
+	def extended(self, rows):
+		# New rows in the columns of the flights, numbers of the same type
+		rows = pd.DataFrame({column: rows[column].values.astype(
+								 values.dtype if pd.api.types.is_numeric_dtype(values) else object)
+							 for column, values in self.flights.items()})
+		delta = rows if self.delta is None else pd.concat([self.delta, rows], ignore_index=True)
+
+		flights, base = self.flights, self.base
+		if len(delta) >= COMPACT_ROWS:
+			if self.cache_dir is not None and base.source is not None:
+				flights, base = compact_rows(flights, base, delta, self.cache_dir)
+			else:
+				flights = append_rows(flights, delta)
+				base = FlightIndex(flights)
+			delta = None
+
+		cube = self.cube.added(rows['name'].values, rows['arr_delay'].values)
+		return Snapshot(flights, base, cube, self.stats.added(rows), self.version + 1,
+						delta, self.cache_dir)
+
+# Container for the loaded frames and what it cost to load them
+class Datasets(object):
+
+	def __init__(self, flights, routes, load_seconds, index = None, cache_dir = None):
+		# Flat table of the routes drawn on the map
+		self.routes = routes
+		self.load_seconds = load_seconds
+
+		# The index is built here unless it was mapped from the cache
+		start = time.time()
+		index = index if index is not None else FlightIndex(flights)
+		self.snapshot = Snapshot(flights, index, DelayCube(index, low = -60, high = 180),
+								 CarrierStats.from_index(index), 0, cache_dir = cache_dir)
+		self.index_seconds = time.time() - start
+
+	# The latest snapshot's data
+	@property
+	def index(self):
+		return self.snapshot.index
+
+	@property
+	def cube(self):
+		return self.snapshot.cube
+
+	@property
+	def stats(self):
+		return self.snapshot.stats
+
+	@property
+	def version(self):
+		return self.snapshot.version
+
+	# Snapshot with new rows added, see Snapshot.extended
+	def extended(self, rows):
+		return self.snapshot.extended(rows)
+
+	# Swap in a snapshot made by extended(). Run on the server loop so the
+	# session callbacks see the new rows from their next run.
+	def fold(self, snapshot):
+		self.snapshot = snapshot
+
+	def memory_bytes(self):
+		snapshot = self.snapshot
+		index_bytes = snapshot.index.nbytes + snapshot.cube.cumulative.nbytes
+		stats_bytes = sum(stats.sketch.nbytes() for stats in snapshot.stats.carriers.values())
+		flights_bytes = sum(frame.memory_usage(deep=True).sum()
+							for frame in (snapshot.flights, snapshot.delta) if frame is not None)
+		return {'flights': int(flights_bytes),
+				'index': int(index_bytes),
+				'stats': int(stats_bytes),
+				'routes': int(sum(values.nbytes for values in self.routes.columns.values()
+								  if hasattr(values, 'nbytes')))}
+
+	def report(self):
+		memory = self.memory_bytes()
+		return {'flights_rows': len(self.index),
+				'map_rows': len(self.routes),
+				'load_seconds': round(self.load_seconds, 3),
+				'index_seconds': round(self.index_seconds, 3),
+				'memory_bytes': memory,
+				'memory_mb': round(sum(memory.values()) / 2 ** 20, 1)}
+
+# Make sure a frame has the columns the tabs need and is not empty
+def validate(frame, required, label, numeric=()):
+	missing = [column for column in required if column not in frame.columns]
+	if missing:
+		raise ValueError('%s is missing columns: %s' % (label, ', '.join(missing)))
+
+	if len(frame) == 0:
+		raise ValueError('%s has no rows' % label)
+
+	for column in numeric:
+		if not pd.api.types.is_numeric_dtype(frame[column]):
+			raise ValueError('%s has a non-numeric %s column' % (label, column))
+
+def flights_cache_dir(data_dir=DATA_DIR):
+	return CACHE_DIR or join(data_dir, 'cache', 'flights')
+
+# Flights frame and index, mapped from the on-disk cache
+def read_flights(data_dir=DATA_DIR):
+	# Only the columns the tabs use
+	flights = load_flights(join(data_dir, 'flights.csv'), FLIGHTS_COLUMNS,
+						   flights_cache_dir(data_dir))
+	validate(flights, FLIGHTS_COLUMNS, 'flights.csv', numeric=['arr_delay'])
+
+	return flights, load_index(flights, flights_cache_dir(data_dir))
+
+def read_datasets(data_dir=DATA_DIR):
+	start = time.time()
+
+	flights, index = read_flights(data_dir)
+
+	# Routes for the map, built by scripts/build_map.py, or the formatted
+	# flight delay data from the notebook when it has not been built
+	if os.path.exists(join(data_dir, 'flights_map.npz')):
+		routes = RouteTable.load(join(data_dir, 'flights_map.npz'))
+	else:
+		map_data = pd.read_csv(join(data_dir, 'flights_map.csv'),
+							   header=[0,1], index_col=0)
+		validate(map_data, MAP_COLUMNS, 'flights_map.csv')
+		routes = RouteTable.from_map_data(map_data)
+
+	return Datasets(flights, routes, time.time() - start, index,
+					cache_dir = flights_cache_dir(data_dir))
+
+# Load the datasets for this process (only the first call reads from disk)
+def load_datasets(data_dir=DATA_DIR):
+	global _datasets
+
+	with _lock:
+		if _datasets is None:
+			_datasets = read_datasets(data_dir)
+			logger.info('Loaded flight datasets: %s', _datasets.report())
+
+	return _datasets
+
+# Build the on-disk caches of the flights and the index without keeping
+# them, so processes forked afterwards all map the same files
+def prepare_cache(data_dir=DATA_DIR):
+	start = time.time()
+	n_rows = len(read_flights(data_dir)[0])
+	logger.info('Flights cache of %d rows ready in %s in %.2fs', n_rows,
+				flights_cache_dir(data_dir), time.time() - start)
+
+# Shared datasets, loading them now if the server hook did not run
+def get_datasets():
+	return load_datasets()
@@ -0,0 +1,101 @@
+# Columnar table of the routes drawn on the flight map
+#
+# flights_map.csv has a two level header (e.g. ('start_long',
+# 'Unnamed: 20_level_1')) which used to be read row by row with iterrows()
+# on every checkbox change. The table is flattened once at load time into
+# typed arrays with plain column names, sorted by carrier, and every
+# carrier's block of routes (including the flight line coordinates) is
+# kept ready so a selection is a concatenation of blocks. The same table
+# can be loaded from the .npz built by scripts/build_map.py.
+
+import numpy as np
+import pandas as pd
+
+# (first level, second level) of flights_map.csv -> column name. A second
+# level starting with 'Unnamed' stands for the first level alone.
+MAP_COLUMNS = {'carrier': 'carrier', 'origin': 'origin', 'dest': 'dest',
+			   ('arr_delay', 'count'): 'count',
+			   ('arr_delay', 'mean'): 'mean_delay',
+			   ('arr_delay', 'min'): 'min_delay',
+			   ('arr_delay', 'max'): 'max_delay',
+			   ('distance', 'mean'): 'distance',
+			   'start_long': 'origin_x_loc', 'start_lati': 'origin_y_loc',
+			   'end_long': 'dest_x_loc', 'end_lati': 'dest_y_loc'}
+
+# Type of each column sent to the browser (the rest are strings)
+COLUMN_TYPES = {'count': np.int32, 'mean_delay': np.float32,
+				'min_delay': np.float32, 'max_delay': np.float32,
+				'distance': np.float32,
+				'origin_x_loc': np.float32, 'origin_y_loc': np.float32,
+				'dest_x_loc': np.float32, 'dest_y_loc': np.float32}
+
+# Flat frame with the MAP_COLUMNS names from the two level map data
+def flatten_map_data(map_data):
+	columns = {}
+	for first, second in map_data.columns:
+		key = first if str(second).startswith('Unnamed') else (first, second)
+		if key in MAP_COLUMNS:
+			columns[MAP_COLUMNS[key]] = map_data[(first, second)].values
+
+	return pd.DataFrame(columns)
+
+class RouteTable(object):
+
+	def __init__(self, routes):
+		routes = routes.sort_values('carrier', kind='mergesort')
+
+		self.columns = {name: (routes[name].values.astype(COLUMN_TYPES[name])
+							   if name in COLUMN_TYPES else routes[name].values.astype(object))
+						for name in routes.columns}
+
+		# Flight lines from origin to destination, two float32 points each
+		self.columns['flight_x'] = np.column_stack(
+			[self.columns['origin_x_loc'], self.columns['dest_x_loc']])
+		self.columns['flight_y'] = np.column_stack(
+			[self.columns['origin_y_loc'], self.columns['dest_y_loc']])
+
+		# Each carrier's block of routes
+		carriers = self.columns['carrier']
+		starts = np.flatnonzero(np.r_[True, carriers[1:] != carriers[:-1]]) if len(carriers) else []
+		stops = np.r_[starts[1:], len(carriers)] if len(carriers) else []
+
+		self.carriers = [carriers[start] for start in starts]
+		self.blocks = {carriers[start]: {name: values[start:stop]
+										 for name, values in self.columns.items()}
+					   for start, stop in zip(starts, stops)}
+
+	@classmethod
+	def from_map_data(cls, map_data):
+		return cls(flatten_map_data(map_data))
+
+	# Route table written by scripts/build_map.py
+	@classmethod
+	def load(cls, path):
+		names = list(MAP_COLUMNS.values())
+		with np.load(path) as artifact:
+			return cls(pd.DataFrame({name: artifact[name] for name in names}))
+
+	def __len__(self):
+		return len(self.columns['carrier'])
+
+	# Columns for the routes of the carriers in carrier_list, with the
+	# color of each route from the colors dictionary
+	def select(self, carrier_list, colors):
+		blocks = [self.blocks[carrier] for carrier in carrier_list if carrier in self.blocks]
+		data = {}
+
+		for name, values in self.columns.items():
+			parts = [block[name] for block in blocks]
+			if isinstance(values, np.ndarray) and values.ndim == 2:
+				# multi_line takes one array per line
+				data[name] = list(np.concatenate(parts + [values[:0]]))
+			elif isinstance(values, np.ndarray):
+				data[name] = np.concatenate(parts + [values[:0]])
+			else:
+				data[name] = [value for part in parts for value in part]
+
+		# One color per block repeated for each of its routes
+		block_colors = np.array([colors[block['carrier'][0]] for block in blocks], dtype=object)
+		data['color'] = np.repeat(block_colors, [len(block['carrier']) for block in blocks])
+
+		return data
@@ -5,7 +5,7 @@ import numpy as np
 from bokeh.plotting import figure
 
 from bokeh.models import (CategoricalColorMapper, HoverTool, 
-						  ColumnDataSource, Panel, 
+						  ColumnDataSource, Panel, Range1d,
 						  FuncTickFormatter, SingleIntervalTicker, LinearAxis)
 
 from bokeh.models.widgets import (CheckboxGroup, Slider, RangeSlider, 
@@ -15,56 +15,105 @@ from bokeh.models.widgets import (CheckboxGroup, Slider, RangeSlider,
 from bokeh.layouts import column, row, WidgetBox
 from bokeh.palettes import Category20_16
 
-# List of lists to single list
-from itertools import chain
+from scripts import metrics
+from scripts.binning import group_counts
+from scripts.cache import cached_dataset, copy_columns
+from scripts.config import ROUTE_LOD_BINS, ROUTE_LOD_ROWS
+from scripts.scheduler import CallbackScheduler
+from scripts.updates import update_source
+from scripts.ingest import listen
 
-def route_tab(flights):
+# Make dataset for plot based on route start (origin) and 
+# end (destination), limited to the delays in window (start, end)
+# when the plot is zoomed in. Busy routes (more than max_points flights in
+# the window) are binned into strips of n_bins bins.
+def route_dataset(index, origin, destination, window = None,
+				  max_points = ROUTE_LOD_ROWS, n_bins = ROUTE_LOD_BINS):
+	# Delays on the selected route for each carrier who covers it
+	by_carrier = index.route_carrier_delays(origin, destination)
 
-	# Make dataset for plot based on route start (origin) and 
-	# end (destination)
-	def make_dataset(origin, destination):
-		# Subset to the selected route
-		subset = flights[(flights['dest'] == destination) & (flights['origin'] == origin)]
-		
-		# Find the carriers who cover particular route
-		carriers = list(set(subset['name']))
+	carriers = list(by_carrier)
+	delays = [by_carrier[carrier] for carrier in carriers]
+	metrics.rows_scanned.observe(sum(len(d) for d in delays), tab = 'route')
 
-		# x is the delay, y is the airline
-		xs = []
-		ys = []
-		label_dict = {}
-		
-		# Iterate through the unique carriers
-		for i, carrier in enumerate(carriers):
-			
-			# Subset to the carrier
-			carrier_data = subset[subset['name'] == carrier]
-			
-			# Append the index of the carrier as many times as there are flights
-			# Append the delays for the carrier
-			ys.append([i for _ in range(len(carrier_data))])
-			xs.append(list(carrier_data['arr_delay']))
-  
-			# Map the index to the carrier
-			label_dict[i]= carrier
-			
-		xs = list(chain(*xs))
-		ys = list(chain(*ys))
-			
-		new_src = ColumnDataSource(data = {'x': xs, 'y': ys})
-		
-		return new_src, label_dict
+	# Map the index to the carrier
+	label_dict = {i: carrier for i, carrier in enumerate(carriers)}
+
+	# Whole range of delays when not zoomed in
+	if window is None:
+		low = min([d.min() for d in delays if len(d)] or [0])
+		high = max([d.max() for d in delays if len(d)] or [0])
+		window = (low - 5, high + 5)
+
+	# Delays inside the window
+	delays = [d[(d >= window[0]) & (d <= window[1])] for d in delays]
+	n_flights = sum(len(d) for d in delays)
+
+	points = {'x': np.empty(0, dtype=np.float32), 'y': np.empty(0, dtype=np.int16)}
+	strips = {'x': np.empty(0, dtype=np.float32), 'y': np.empty(0, dtype=np.int16),
+			  'width': np.empty(0, dtype=np.float32), 'height': np.empty(0, dtype=np.float32),
+			  'count': np.empty(0, dtype=np.int32), 'carrier': []}
+
+	# Few enough flights: one point per flight
+	if n_flights <= max_points:
+		# x is the delay, y is the airline (typed arrays are sent as binary)
+		points['x'] = np.concatenate(delays + [np.empty(0)]).astype(np.float32)
+		points['y'] = np.repeat(np.arange(len(delays)),
+								[len(d) for d in delays]).astype(np.int16)
+
+	# Too many: number of flights in each bin of each carrier's strip
+	else:
+		edges = np.linspace(window[0], window[1], n_bins + 1)
+		counts = group_counts(delays, edges)
+		rows, bins = np.nonzero(counts)
+
+		# Height of each bin relative to the fullest bin of the carrier
+		peaks = counts.max(axis=1)
+
+		strips['x'] = ((edges[bins] + edges[bins + 1]) / 2).astype(np.float32)
+		strips['y'] = rows.astype(np.int16)
+		strips['width'] = np.diff(edges)[bins].astype(np.float32)
+		strips['height'] = (0.9 * counts[rows, bins] / peaks[rows]).astype(np.float32)
+		strips['count'] = counts[rows, bins].astype(np.int32)
+		strips['carrier'] = [label_dict[i] for i in rows]
+
+	return points, strips, label_dict, window
+
+def route_tab(datasets):
+
+	@metrics.timed(metrics.dataset_seconds, tab = 'route')
+	def make_dataset(origin, destination, window = None):
+		# Zoomed windows are rarely the same twice, only whole routes are
+		# shared with the other sessions
+		if window is not None:
+			return route_dataset(datasets.index, origin, destination, window)
+
+		snapshot = datasets.snapshot
+		points, strips, label_dict, window = cached_dataset(
+			lambda: route_dataset(snapshot.index, origin, destination),
+			'route', origin = origin, destination = destination, version = snapshot.version)
+		return copy_columns(points), copy_columns(strips), dict(label_dict), window
 	
 	
-	def make_plot(src, origin, destination, label_dict):
+	def make_plot(src, strip_src, origin, destination, label_dict, window):
 		
 		p = figure(plot_width = 800, plot_height = 400, x_axis_label = 'Delay (min)', y_axis_label = '',
-                title = 'Arrival Delays for Flights from %s to %s' % (origin, destination))
+                title = 'Arrival Delays for Flights from %s to %s' % (origin, destination),
+				   x_range = Range1d(*window))
 
 
 		p.circle('x', 'y', source = src, alpha = 0.4,
 				 color = 'navy', size = 15)
 
+		# Strips with the flights per bin for busy routes
+		strips_glyph = p.rect('x', 'y', width = 'width', height = 'height',
+							  source = strip_src, color = 'navy', alpha = 0.6)
+
+		hover = HoverTool(tooltips=[('Carrier', '@carrier'),
+									('Delay', '$x{0}'),
+									('Flights', '@count')],
+						  renderers = [strips_glyph])
+		p.add_tools(hover)
 		
 		p.yaxis[0].ticker.desired_num_ticks = len(label_dict)
 
@@ -92,14 +141,38 @@ def route_tab(flights):
 		p.yaxis.major_label_text_font_size = '12pt'
 
 		return p
+
+	# Points or strips for the route in the current window
+	def show(window):
+		origin = origin_select.value
+		destination = dest_select.value
+
+		points, strips, label_dict, window = make_dataset(origin, destination, window)
+
+		# Only send the columns that changed
+		update_source(src, points)
+		update_source(strip_src, strips)
+
+		shown_window[0] = window
+		return label_dict, window
 	
 	def update(attr, old, new):
 		# Origin and destination determine values displayed
 		origin = origin_select.value
+		index = datasets.index
+
+		# Only offer the destinations with flights from the origin
+		dest_select.options = index.reachable(origin)
+		if dest_select.value not in dest_select.options and dest_select.options:
+			dest_select.value = dest_select.options[0]
+
 		destination = dest_select.value
+
+		# Carriers labelled on the y axis
+		route_carriers[:] = sorted(index.route_carrier_delays(origin, destination))
 		
-		# Get the new dataset
-		new_src, label_dict = make_dataset(origin, destination)
+		# Get the new dataset for the whole route
+		label_dict, window = show(None)
 		
 		if len(label_dict) == 0:
 			p.title.text = 'No Flights on Record from %s to %s' % (origin, destination)
@@ -113,28 +186,73 @@ def route_tab(flights):
 
 			p.title.text = 'Arrival Delays for Flights from %s to %s' % (origin, destination)
 
-		src.data.update(new_src.data)
+		# Zoom out to the whole route
+		p.x_range.start, p.x_range.end = window
+
+	# Zooming in shows the flights of the window once there are few enough
+	def zoom(attr, old, new):
+		window = (p.x_range.start, p.x_range.end)
+
+		# update() resetting the range to the window it just showed
+		if window == shown_window[0]:
+			return
+
+		show(window)
 	
-	origins = list(set(flights['origin']))
-	dests = list(set(flights['dest']))
+	origins = list(datasets.index.origins)
+
+	# Bursts of widget changes run a single update
+	scheduler = CallbackScheduler(update, tab = 'route')
 
 	origin_select = Select(title = 'Origin', value = 'JFK', options = origins)
-	origin_select.on_change('value', update)
+	scheduler.watch(origin_select, 'value')
+
+	# Destinations reachable from the origin
+	dests = datasets.index.reachable(origin_select.value)
 
-	dest_select = Select(title = 'Destination', value = 'MIA', options = dests)
-	dest_select.on_change('value', update)
+	dest_select = Select(title = 'Destination', options = dests,
+						 value = 'MIA' if 'MIA' in dests or not dests else dests[0])
+	scheduler.watch(dest_select, 'value')
 	
 	initial_origin = origin_select.value
 	initial_dest = dest_select.value
 	
-	src, label_dict = make_dataset(initial_origin, initial_dest)
+	points, strips, label_dict, window = make_dataset(initial_origin, initial_dest)
+	src = ColumnDataSource(data = points)
+	strip_src = ColumnDataSource(data = strips)
+
+	# Window of the points and strips in the sources
+	shown_window = [window]
 	
-	p = make_plot(src, initial_origin, initial_dest, label_dict)
+	p = make_plot(src, strip_src, initial_origin, initial_dest, label_dict, window)
 	p = style(p)
+
+	# Zoom changes are coalesced like widget changes
+	zoom_scheduler = CallbackScheduler(zoom, tab = 'route')
+	zoom_scheduler.watch(p.x_range, 'start', name = 'zoom')
+	zoom_scheduler.watch(p.x_range, 'end', name = 'zoom')
+
+	# New flights can add origins and destinations, and flights in view
+	def refresh(attr, old, new):
+		index = datasets.index
+		origin_select.options = list(index.origins)
+		dest_select.options = index.reachable(origin_select.value)
+
+		carriers = sorted(index.route_carrier_delays(origin_select.value, dest_select.value))
+
+		# A new carrier on the route needs new labels, so redraw the route
+		if carriers != route_carriers:
+			update('data', None, None)
+		else:
+			show((p.x_range.start, p.x_range.end))
+
+	route_carriers = sorted(datasets.index.route_carrier_delays(initial_origin, initial_dest))
+	refresh_scheduler = CallbackScheduler(refresh, tab = 'route')
+	listen(lambda ready: refresh_scheduler.run('data', None, None, ready = ready))
 	
 	controls = WidgetBox(origin_select, dest_select)
 	layout = row(controls, p)
 
 	tab = Panel(child = layout, title = 'Route Details')
 
-	return tab
\ No newline at end of file
+	return tab
@@ -0,0 +1,241 @@
+# Coalescing of widget callbacks for a tab
+#
+# A slider drag sends a change for every tick it passes. Rather than
+# running the tab's update for each one, the scheduler only remembers the
+# latest event and runs the update once the widgets have been quiet for
+# delay milliseconds, or at most max_wait milliseconds after the first
+# event of a burst. The update reads the widgets when it runs, so it
+# always draws the latest state and the intermediate states are dropped
+# before any work is done for them.
+#
+# While the tab of a scheduler is hidden, updates are not run: the latest
+# one is kept and marks the tab dirty, and it runs when the tab is shown.
+#
+# Updates can hand their heavy work to the compute threads with offload.
+# Every event and every update starts a new generation, and the work of an
+# older generation is skipped if it has not started yet, or its results
+# are dropped, so only the latest state is drawn.
+#
+# How long each update waited, ran on the loop, spent applying offloaded
+# results, and took in all from the widget event until it was ready to
+# render is recorded in scripts/metrics.py, labelled with the scheduler's
+# tab and the widget that changed. run can also be given a ready callback,
+# called once an update that started after it is ready to render.
+
+import time
+
+from contextlib import contextmanager
+from functools import partial
+
+from bokeh.io import curdoc
+from tornado.ioloop import IOLoop
+
+from scripts import compute, metrics
+from scripts.config import CALLBACK_DELAY_MS, CALLBACK_MAX_WAIT_MS
+
+# Lists collecting the schedulers created while building a tab
+_collectors = []
+
+# Schedulers created inside the with block, for showing and hiding them
+# with their tab
+@contextmanager
+def collect():
+	schedulers = []
+	_collectors.append(schedulers)
+	try:
+		yield schedulers
+	finally:
+		_collectors.remove(schedulers)
+
+class CallbackScheduler(object):
+
+	def __init__(self, callback, doc = None, delay = CALLBACK_DELAY_MS,
+				 max_wait = CALLBACK_MAX_WAIT_MS, tab = 'none'):
+		# callback(attr, old, new) like a regular on_change callback
+		self.callback = callback
+		self.tab = tab
+		self.doc = doc if doc is not None else curdoc()
+		self.delay = delay
+		self.max_wait = max_wait
+
+		# Latest event waiting to run and when its burst started
+		self.pending = None
+		self.pending_widget = None
+		self.first_event = None
+		self.generation = 0
+		self._timeout = None
+
+		# When the event of the running update came, and whether it
+		# offloaded its work (it is ready to render once that is applied)
+		self.started = None
+		self.offloaded = False
+
+		# Ready callbacks waiting for an update, and the ones the running
+		# update will call
+		self.waiting = []
+		self.readies = None
+
+		# Update held back while the tab is hidden
+		self.visible = True
+		self.dirty = None
+		self.dirty_widget = None
+
+		for schedulers in _collectors:
+			schedulers.append(self)
+
+	# Run the callback when attr of the widget changes. With throttled, the
+	# widget's value_throttled property is watched when it has one, so a
+	# slider only reports where the drag ended up. name labels the widget
+	# in the metrics (its title by default).
+	def watch(self, widget, attr = 'value', throttled = False, name = None):
+		if throttled and attr == 'value' and 'value_throttled' in widget.properties():
+			attr = 'value_throttled'
+
+		if name is None:
+			name = getattr(widget, 'title', None) or type(widget).__name__
+
+		widget.on_change(attr, lambda attr, old, new: self.trigger(attr, old, new, name))
+
+	# on_change callback for the watched widgets
+	def trigger(self, attr, old, new, widget = 'none'):
+		now = time.time()
+		self.generation += 1
+
+		if self.pending is None:
+			self.first_event = now
+		# Keep the first old value so the update sees the whole change
+		else:
+			old = self.pending[1]
+		self.pending = (attr, old, new)
+		self.pending_widget = widget
+
+		# Wait for the widgets to be quiet, but not past max_wait
+		wait = min(self.delay, max(self.max_wait - 1000 * (now - self.first_event), 0))
+
+		if self._timeout is not None:
+			self.doc.remove_timeout_callback(self._timeout)
+		self._timeout = self.doc.add_timeout_callback(self.flush, wait)
+
+	# Run the callback for the latest event
+	def flush(self):
+		self._timeout = None
+
+		pending, widget, first_event = self.pending, self.pending_widget, self.first_event
+		if pending is not None:
+			metrics.callback_wait_seconds.observe(time.time() - first_event,
+												  tab = self.tab, widget = widget)
+
+		self.pending = None
+		self.pending_widget = None
+		self.first_event = None
+
+		if pending is not None:
+			self.run(*pending, widget = widget, started = first_event)
+
+	# Run the callback now, or mark the tab dirty if it is hidden. widget
+	# labels the metrics, the attr is used without one (e.g. 'data').
+	# started is when the event came (now by default). ready() is called
+	# when the update is ready to render, it is dropped if the tab is
+	# hidden.
+	def run(self, attr, old, new, widget = None, started = None, ready = None):
+		widget = widget if widget is not None else attr
+
+		if not self.visible:
+			# Offloaded work of the tab is out of date as well
+			self.generation += 1
+			if self.dirty is not None:
+				old = self.dirty[1]
+			self.dirty = (attr, old, new)
+			self.dirty_widget = widget
+			return
+
+		if ready is not None:
+			self.waiting.append(ready)
+		self.call((attr, old, new), widget, started)
+
+	# Run the callback, timing it and labelling what it records
+	def call(self, event, widget, started = None):
+		self.generation += 1
+		start = time.time()
+		self.started = started if started is not None else start
+		self.offloaded = False
+		self.readies = list(self.waiting)
+
+		try:
+			with metrics.labels(tab = self.tab, widget = widget):
+				self.callback(*event)
+		finally:
+			started, self.started = self.started, None
+			readies, self.readies = self.readies, None
+
+		end = time.time()
+		metrics.callback_seconds.observe(end - start, tab = self.tab, widget = widget)
+		if not self.offloaded:
+			metrics.update_seconds.observe(end - started, tab = self.tab, widget = widget)
+			self.ready(readies)
+
+	# Run tasks (functions without arguments that do not touch the
+	# document) in parallel on the compute threads, then apply(results) on
+	# the document's loop, unless a newer event or update came first
+	def offload(self, tasks, apply):
+		generation = self.generation
+		labels = metrics.current_labels()
+		start = time.time()
+		started = self.started if self.started is not None else start
+		readies = self.readies or []
+		self.offloaded = True
+
+		# Adding a callback to a document sets bokeh's current document for
+		# the whole process, so it is done on the loop rather than from the
+		# compute threads, where it could change the document of a tab the
+		# loop is building
+		loop = IOLoop.current()
+
+		def superseded():
+			return self.generation != generation
+
+		def done(results, error):
+			metrics.dataset_seconds.observe(time.time() - start, tab = self.tab)
+			if not superseded():
+				loop.add_callback(self.doc.add_next_tick_callback,
+								  partial(self.apply, generation, labels, started, readies,
+										  apply, results, error))
+
+		compute.fan_out(tasks, done, superseded)
+
+	# Apply offloaded results if they are still the latest
+	def apply(self, generation, labels, started, readies, apply, results, error):
+		if self.generation != generation:
+			return
+		if error is not None:
+			raise error
+
+		start = time.time()
+		with metrics.labels(**labels):
+			apply(results)
+
+		end = time.time()
+		metrics.apply_seconds.observe(end - start, **labels)
+		metrics.update_seconds.observe(end - started, **labels)
+		self.ready(readies)
+
+	# Call the ready callbacks still waiting. The ones of a superseded
+	# update are left for the update that superseded it.
+	def ready(self, readies):
+		for ready in readies:
+			if ready in self.waiting:
+				self.waiting.remove(ready)
+				ready()
+
+	def hide(self):
+		self.visible = False
+
+	# Catch up with the changes made while hidden
+	def show(self):
+		self.visible = True
+
+		dirty, widget = self.dirty, self.dirty_widget
+		self.dirty = None
+		self.dirty_widget = None
+		if dirty is not None:
+			self.call(dirty, widget)
@@ -0,0 +1,204 @@
+# Mergeable per carrier statistics for the Summary Table
+#
+# Each carrier has a DelayStats accumulator with the exact count, min, max
+# and sum of its delays and a QuantileSketch for the median and other
+# percentiles. Accumulators fill from chunks of rows and merge with each
+# other, so statistics computed on separate chunks or in worker processes
+# combine into the same result, and new rows are added without rescanning
+# the old ones.
+#
+# QuantileSketch error bound: the sketch keeps counts of delays in
+# logarithmic buckets (like DDSketch). Any quantile it returns is within
+# a relative error alpha (default 1%) of the delay at that rank, i.e.
+# |estimate - true| <= alpha * |true|, so a median of 30 minutes is off by
+# at most 0.3 minutes, and delays of 0 are exact. The bucket count grows
+# with the log of the spread of the delays (about 350 buckets each for
+# positive and negative delays between 1 minute and a day) and is capped
+# at max_buckets by merging the buckets closest to zero; only quantiles
+# falling in merged buckets lose the bound. The rank used is the lower
+# one, q * (n - 1) rounded down, where pandas interpolates between two
+# neighbouring delays.
+
+import copy
+import math
+
+import numpy as np
+
+class QuantileSketch(object):
+
+	def __init__(self, alpha = 0.01, max_buckets = 2048):
+		self.alpha = alpha
+		self.max_buckets = max_buckets
+		self.gamma = (1 + alpha) / (1 - alpha)
+		self.log_gamma = math.log(self.gamma)
+
+		self.count = 0
+		self.zeros = 0
+
+		# Bucket key -> number of values, for positive and negative values
+		self.positive = {}
+		self.negative = {}
+
+	# Bucket of each magnitude, values in (gamma ** (k-1), gamma ** k]
+	def keys(self, magnitudes):
+		return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+	def add(self, values):
+		values = np.asarray(values, dtype=np.float64)
+		values = values[~np.isnan(values)]
+
+		self.count += len(values)
+		self.zeros += int(np.count_nonzero(values == 0))
+
+		for store, magnitudes in ((self.positive, values[values > 0]),
+								  (self.negative, -values[values < 0])):
+			keys, counts = np.unique(self.keys(magnitudes), return_counts=True)
+			for key, count in zip(keys.tolist(), counts.tolist()):
+				store[key] = store.get(key, 0) + count
+			self.collapse(store)
+
+	def merge(self, other):
+		self.count += other.count
+		self.zeros += other.zeros
+		for store, other_store in ((self.positive, other.positive),
+								   (self.negative, other.negative)):
+			for key, count in other_store.items():
+				store[key] = store.get(key, 0) + count
+			self.collapse(store)
+
+	# Merge the buckets closest to zero when there are too many
+	def collapse(self, store):
+		if len(store) <= self.max_buckets:
+			return
+
+		keys = sorted(store)
+		extra = keys[:len(keys) - self.max_buckets + 1]
+		store[extra[-1]] = sum(store.pop(key) for key in extra[:-1]) + store[extra[-1]]
+
+	# Value at quantile q (0 to 1)
+	def quantile(self, q):
+		if self.count == 0:
+			return float('nan')
+
+		rank = int(q * (self.count - 1))
+
+		# Negative values from the most negative, then zeros, then positive
+		for key in sorted(self.negative, reverse=True):
+			rank -= self.negative[key]
+			if rank < 0:
+				return -self.value(key)
+
+		rank -= self.zeros
+		if rank < 0:
+			return 0.0
+
+		for key in sorted(self.positive):
+			rank -= self.positive[key]
+			if rank < 0:
+				return self.value(key)
+
+		return self.value(max(self.positive))
+
+	# Middle of a bucket with the same relative error to both of its ends
+	def value(self, key):
+		return 2 * self.gamma ** key / (self.gamma + 1)
+
+	def nbytes(self):
+		return 100 * (len(self.positive) + len(self.negative))
+
+class DelayStats(object):
+
+	def __init__(self, alpha = 0.01):
+		self.count = 0
+		self.total = 0.0
+		self.min = float('inf')
+		self.max = float('-inf')
+		self.sketch = QuantileSketch(alpha)
+
+	def add(self, delays):
+		delays = np.asarray(delays, dtype=np.float64)
+		delays = delays[~np.isnan(delays)]
+		if len(delays) == 0:
+			return
+
+		self.count += len(delays)
+		self.total += float(delays.sum())
+		self.min = min(self.min, float(delays.min()))
+		self.max = max(self.max, float(delays.max()))
+		self.sketch.add(delays)
+
+	def merge(self, other):
+		self.count += other.count
+		self.total += other.total
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		self.sketch.merge(other.sketch)
+
+	@property
+	def mean(self):
+		return self.total / self.count if self.count else float('nan')
+
+	# Sketch estimate, not rounded to whole minutes as rounding would add
+	# up to half a minute to the error bound
+	def quantile(self, q):
+		return self.sketch.quantile(q)
+
+class CarrierStats(object):
+
+	def __init__(self, alpha = 0.01):
+		self.alpha = alpha
+		self.carriers = {}
+
+	def stats(self, carrier):
+		if carrier not in self.carriers:
+			self.carriers[carrier] = DelayStats(self.alpha)
+		return self.carriers[carrier]
+
+	# Add a chunk of rows given as carrier names and delays
+	def add(self, names, delays):
+		names, codes = np.unique(np.asarray(names, dtype=object), return_inverse=True)
+		delays = np.asarray(delays, dtype=np.float64)
+
+		order = np.argsort(codes, kind='stable')
+		offsets = np.searchsorted(codes[order], np.arange(len(names) + 1))
+		for i, carrier in enumerate(names):
+			self.stats(carrier).add(delays[order[offsets[i]:offsets[i + 1]]])
+
+	def add_frame(self, frame):
+		self.add(frame['name'].values, frame['arr_delay'].values)
+
+	# New accumulators with a frame of rows added, leaving these unchanged.
+	# Only the accumulators of the carriers in the rows are copied.
+	def added(self, frame):
+		carrier_stats = CarrierStats(self.alpha)
+		carrier_stats.carriers = dict(self.carriers)
+		for carrier in np.unique(np.asarray(frame['name'].values, dtype=object)):
+			if carrier in self.carriers:
+				carrier_stats.carriers[carrier] = copy.deepcopy(self.carriers[carrier])
+
+		carrier_stats.add_frame(frame)
+		return carrier_stats
+
+	def merge(self, other):
+		for carrier, stats in other.carriers.items():
+			self.stats(carrier).merge(stats)
+
+	# Accumulators for every carrier of a FlightIndex
+	@classmethod
+	def from_index(cls, index, alpha = 0.01):
+		carrier_stats = cls(alpha)
+		for carrier in index.carriers:
+			carrier_stats.stats(carrier).add(index.carrier_delays(carrier))
+		return carrier_stats
+
+	# Columns of the Summary Table, one row per airline
+	def table(self):
+		airlines = sorted(self.carriers)
+		stats = [self.carriers[airline] for airline in airlines]
+
+		return {'airline': np.array(airlines, dtype=object),
+				'flights': np.array([s.count for s in stats], dtype=np.int32),
+				'min': np.array([s.min for s in stats]),
+				'mean': np.array([s.mean for s in stats]),
+				'median': np.array([s.quantile(0.5) for s in stats]),
+				'max': np.array([s.max for s in stats])}
@@ -1,28 +1,46 @@
-# pandas and numpy for data manipulation
-import pandas as pd
-import numpy as np
-
 from bokeh.models import ColumnDataSource, Panel
-from bokeh.models.widgets import TableColumn, DataTable
+from bokeh.models.widgets import TableColumn, DataTable, NumberFormatter
+
+from scripts import metrics
+from scripts.cache import cached_dataset, copy_columns
+from scripts.ingest import listen
+from scripts.updates import update_source
+
+def table_tab(datasets):
+
+	# Summary stats come from the per carrier accumulators, so refreshing
+	# the table after new rows are added does not rescan the flights. The
+	# table is the same for every session.
+	def table():
+		snapshot = datasets.snapshot
+		return copy_columns(cached_dataset(lambda: summary(snapshot.stats), 'table',
+										   version = snapshot.version))
+
+	# Rows of the table from the accumulators, no flights are read
+	def summary(stats):
+		metrics.rows_scanned.observe(0, tab = 'table')
+		return stats.table()
+
+	carrier_src = ColumnDataSource(data = table())
 
-def table_tab(flights):
+	# Only the rows of carriers with new flights change
+	def refresh(ready):
+		with metrics.labels(tab = 'table', widget = 'data'):
+			update_source(carrier_src, table(), key = 'airline')
+		ready()
 
-	# Calculate summary stats for table
-	carrier_stats = flights.groupby('name')['arr_delay'].describe()
-	carrier_stats = carrier_stats.reset_index().rename(
-		columns={'name': 'airline', 'count': 'flights', '50%':'median'})
+	listen(refresh)
 
-	# Round statistics for display
-	carrier_stats['mean'] = carrier_stats['mean'].round(2)
-	carrier_src = ColumnDataSource(carrier_stats)
+	# Statistics are rounded for display in the browser
+	delay_format = NumberFormatter(format='0.[00]')
 
 	# Columns of table
 	table_columns = [TableColumn(field='airline', title='Airline'),
 					 TableColumn(field='flights', title='Number of Flights'),
-					 TableColumn(field='min', title='Min Delay'),
-					 TableColumn(field='mean', title='Mean Delay'),
-					 TableColumn(field='median', title='Median Delay'),
-					 TableColumn(field='max', title='Max Delay')]
+					 TableColumn(field='min', title='Min Delay', formatter=delay_format),
+					 TableColumn(field='mean', title='Mean Delay', formatter=delay_format),
+					 TableColumn(field='median', title='Median Delay', formatter=delay_format),
+					 TableColumn(field='max', title='Max Delay', formatter=delay_format)]
 
 	carrier_table = DataTable(source=carrier_src, 
 							  columns=table_columns, width=1000)
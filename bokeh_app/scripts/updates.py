@@ -0,0 +1,189 @@
+# Incremental updates of a ColumnDataSource
+#
+# Replacing src.data re-sends every column to the browser. update_source
+# compares the new data with what the source already holds and sends the
+# smallest change it can:
+#
+# - rows are grouped by a key column (the carrier). When the rows of the
+#   keys both datasets share are unchanged, the rows of new keys are
+#   appended with stream() and the rows of dropped keys are removed with
+#   patch() and stream() rollover, so only the rows of the carriers that
+#   changed are sent.
+# - when the number of rows is the same, only the columns that changed are
+#   sent with patch().
+# - anything else replaces the data.
+#
+# Added rows end up after the existing ones and removals move rows around,
+# so the rows are not always in the same order as the new data. None of
+# the plots depend on the order of the rows.
+#
+# The rows every update sends and an estimate of their bytes are recorded
+# in scripts/metrics.py.
+
+import numpy as np
+
+from scripts import metrics
+
+# Number of rows in a dict of columns
+def n_rows(data):
+	return len(next(iter(data.values()))) if data else 0
+
+# Whether two values (numbers, strings, arrays or lists of them) are equal
+def same(a, b):
+	if isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and \
+			a.dtype != object and b.dtype != object:
+		if a.shape != b.shape:
+			return False
+		if a.dtype.kind == 'f' and b.dtype.kind == 'f':
+			return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+		return bool(np.all(a == b))
+
+	if isinstance(a, (list, tuple, np.ndarray)) or isinstance(b, (list, tuple, np.ndarray)):
+		if not isinstance(a, (list, tuple, np.ndarray)) or \
+				not isinstance(b, (list, tuple, np.ndarray)) or len(a) != len(b):
+			return False
+		return all(same(x, y) for x, y in zip(a, b))
+
+	return a == b or (a != a and b != b)
+
+# Estimated bytes of column values sent to the browser: arrays by their
+# size, lists by their items, strings by their length and numbers as 8
+# bytes. Messages encoded as JSON rather than binary buffers (patches,
+# lists of numbers) take more, and the message framing is not counted.
+def payload_bytes(value):
+	if isinstance(value, np.ndarray) and value.dtype != object:
+		return value.nbytes
+	if isinstance(value, dict):
+		return sum(payload_bytes(values) for values in value.values())
+	if isinstance(value, (list, tuple, np.ndarray)):
+		return sum(payload_bytes(item) for item in value)
+	if isinstance(value, str):
+		return len(value)
+	return 8
+
+# Rows and bytes sent by one update_source call
+class Sent(object):
+
+	def __init__(self):
+		self.rows = 0
+		self.bytes = 0
+
+	def stream(self, src, data, rollover = None):
+		self.rows += n_rows(data)
+		self.bytes += payload_bytes(data)
+		src.stream(data, rollover = rollover)
+
+	# patches: {column: [(slice, values)]}, every column patching the same rows
+	def patch(self, src, patches):
+		self.rows += sum(len(values) for _, values in next(iter(patches.values())))
+		self.bytes += sum(payload_bytes(values) for column in patches.values()
+						  for _, values in column)
+		src.patch(patches)
+
+	def replace(self, src, data):
+		self.rows += n_rows(data)
+		self.bytes += payload_bytes(data)
+		src.data = dict(data)
+
+# Rows holding each key, in order: {key: [row, ...]}
+def groups(keys):
+	found = {}
+	for i, key in enumerate(keys):
+		found.setdefault(key, []).append(i)
+	return found
+
+# Values of a column at some rows
+def rows_of(values, rows):
+	if isinstance(values, np.ndarray):
+		return values[rows]
+	return [values[i] for i in rows]
+
+# Remove some rows from the source. rollover keeps the last rows of a
+# source, so the rows to keep that are in front are first copied over the
+# rows to remove further back; only the copied rows are sent.
+def remove_rows(src, rows, sent):
+	n = n_rows(src.data)
+	removed = set(rows)
+
+	front = [i for i in range(len(rows)) if i not in removed]
+	holes = [i for i in rows if i >= len(rows)]
+
+	# Copy runs of consecutive rows as slices rather than row by row
+	runs = []
+	for hole, i in zip(holes, front):
+		if runs and runs[-1][0] + len(runs[-1][1]) == hole and runs[-1][1][-1] + 1 == i:
+			runs[-1][1].append(i)
+		else:
+			runs.append((hole, [i]))
+
+	if runs:
+		sent.patch(src, {column: [(slice(hole, hole + len(rows)), rows_of(values, rows))
+								  for hole, rows in runs]
+						 for column, values in src.data.items()})
+
+	# Zero-length columns of each column's type, as an empty list would
+	# turn the client's typed arrays into float64 ones
+	sent.stream(src, {column: values[:0] for column, values in src.data.items()},
+				rollover = n - len(rows))
+
+# Try to update src by appending and removing the rows of whole keys
+def update_blocks(src, data, key, sent):
+	old_groups = groups(list(src.data[key]))
+	new_groups = groups(list(data[key]))
+
+	# The rows of keys in both datasets have to be unchanged
+	for name in set(old_groups) & set(new_groups):
+		for column in data:
+			if not same(rows_of(src.data[column], old_groups[name]),
+						rows_of(data[column], new_groups[name])):
+				return None
+
+	removed = [name for name in old_groups if name not in new_groups]
+	added = [name for name in new_groups if name not in old_groups]
+
+	# Nothing left to keep, a replacement is just as small
+	if len(removed) == len(old_groups):
+		return None
+
+	if removed:
+		remove_rows(src, sorted(i for name in removed for i in old_groups[name]), sent)
+
+	if added:
+		rows = [i for name in added for i in new_groups[name]]
+		sent.stream(src, {column: rows_of(values, rows) for column, values in data.items()})
+
+	return 'blocks' if added or removed else 'unchanged'
+
+# Update src to hold data, sending as little as possible to the browser.
+# Returns how the source was updated.
+def update_source(src, data, key = None):
+	sent = Sent()
+	kind = send_update(src, data, key, sent)
+
+	if kind != 'unchanged':
+		metrics.update_rows.observe(sent.rows, kind = kind)
+		metrics.update_bytes.observe(sent.bytes, kind = kind)
+
+	return kind
+
+def send_update(src, data, key, sent):
+	if set(src.data) != set(data) or n_rows(src.data) == 0 or n_rows(data) == 0:
+		sent.replace(src, data)
+		return 'replace'
+
+	if key is not None:
+		kind = update_blocks(src, data, key, sent)
+		if kind is not None:
+			return kind
+
+	# Same number of rows: send only the columns that changed
+	if n_rows(src.data) == n_rows(data):
+		n = n_rows(data)
+		changed = {column: [(slice(0, n), values)] for column, values in data.items()
+				   if not same(src.data[column], values)}
+		if changed:
+			sent.patch(src, changed)
+		return 'patch' if changed else 'unchanged'
+
+	sent.replace(src, data)
+	return 'replace'
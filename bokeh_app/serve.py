@@ -0,0 +1,56 @@
+# Run the app like bokeh serve, with the performance metrics of
+# scripts/metrics.py served next to it at /metrics
+#
+# With --num-procs N the server forks N worker processes. The flights and
+# index caches are built here first, so every worker maps the same files
+# read-only rather than loading a copy of its own (bokeh serve
+# --num-procs works too, the first worker builds the caches while the
+# others wait for it). The metrics are per worker, each request to
+# /metrics is answered by one of them.
+#
+# Run from the directory containing bokeh_app:
+#     python bokeh_app/serve.py [--port 5006] [--num-procs 4]
+
+import argparse
+import logging
+import os
+import sys
+
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.server.server import Server
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The app imports scripts.* from its directory, the handler needs the same
+# modules as this file
+sys.path.insert(0, APP_DIR)
+
+from scripts.metrics import MetricsHandler
+from scripts.registry import prepare_cache
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Serve the flights app with /metrics')
+	parser.add_argument('--port', type = int, default = 5006)
+	parser.add_argument('--address', default = None)
+	parser.add_argument('--allow-websocket-origin', action = 'append', default = None,
+						help = 'host[:port] allowed to open sessions (default: the address)')
+	parser.add_argument('--num-procs', type = int, default = 1,
+						help = 'worker processes sharing the mapped data (0: one per core)')
+	args = parser.parse_args()
+
+	logging.basicConfig(level = logging.INFO, format = '%(asctime)s %(message)s')
+
+	if args.num_procs != 1:
+		prepare_cache()
+
+	application = Application(DirectoryHandler(filename = APP_DIR))
+	server = Server({'/bokeh_app': application}, port = args.port, address = args.address,
+					allow_websocket_origin = args.allow_websocket_origin,
+					num_procs = args.num_procs,
+					extra_patterns = [('/metrics', MetricsHandler)])
+
+	server.start()
+	logging.info('Serving http://%s:%d/bokeh_app with metrics at /metrics',
+				 args.address or 'localhost', args.port)
+	server.io_loop.start()
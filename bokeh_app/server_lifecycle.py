@@ -0,0 +1,75 @@
+# Hooks called by the bokeh server for the whole process (not per session)
+
+import logging
+import os
+import time
+
+_start = time.time()
+
+# Imported here so the modules are cached for every session's main.py and
+# the first session does not pay for them
+from bokeh.document import Document
+from bokeh.io.doc import set_curdoc
+
+from scripts.cache import dataset_cache
+from scripts.config import INGEST_PATH
+from scripts.geometry import TOLERANCES, contiguous_states, state_level
+from scripts.ingest import Ingestor, forget, open_source
+from scripts.registry import DATA_DIR, load_datasets
+from scripts.histogram import histogram_tab
+from scripts.density import density_tab
+from scripts.table import table_tab
+from scripts.draw_map import map_tab
+from scripts.routes import route_tab
+
+logger = logging.getLogger(__name__)
+
+_import_seconds = time.time() - _start
+
+# Build every tab once in a scratch document, which puts the datasets of
+# their default widget states in the shared cache, so new sessions only
+# look them up
+def prewarm(datasets):
+	start = time.time()
+	doc = Document()
+	set_curdoc(doc)
+
+	histogram_tab(datasets)
+	density_tab(datasets)
+	table_tab(datasets)
+	map_tab(datasets.routes, contiguous_states())
+	route_tab(datasets)
+
+	# The scratch tabs do not take new flights
+	forget(doc)
+	set_curdoc(Document())
+
+	logger.info('Prewarmed %d tab datasets (%d bytes) in %.2fs', len(dataset_cache),
+				dataset_cache.nbytes, time.time() - start)
+
+# Load the flights data once when the server starts
+def on_server_loaded(server_context):
+	datasets = load_datasets()
+
+	# Simplified state outlines for every zoom level of the map
+	for tolerance in TOLERANCES:
+		state_level(tolerance)
+
+	prewarm(datasets)
+
+	logger.info('Flights data ready in %.2fs, using %.1f MB (app imports took %.2fs)',
+				datasets.load_seconds, datasets.report()['memory_mb'], _import_seconds)
+
+	# Take in new flights while the server runs
+	if INGEST_PATH:
+		# Tailing the loaded file only reads the rows added from now on
+		loaded = os.path.abspath(os.path.join(DATA_DIR, 'flights.csv'))
+		source = open_source(INGEST_PATH, from_end = os.path.abspath(INGEST_PATH) == loaded)
+
+		Ingestor(datasets, source).start()
+		logger.info('Taking in new flights from %s', INGEST_PATH)
+
+# Closed sessions no longer get new flights
+def on_session_destroyed(session_context):
+	forget(session_context._document)
+	dataset_cache.log_stats()